@@ -0,0 +1,126 @@
+import os
+import re
+import sys
+import json
+import unicodedata
+import argparse
+import numpy as np
+from preprocess_documents import get_embeddings_local, embed_with_retry
+
+EVALUATION_SOURCE_DIRECTORY = os.path.join("course_content", "evaluaciones")
+# Deben coincidir con los valores por defecto de core_service/app/core/evaluation.py.
+DEFAULT_ACCEPT_THRESHOLD = float(os.getenv("EVAL_ACCEPT_THRESHOLD", "0.86"))
+DEFAULT_REJECT_THRESHOLD = float(os.getenv("EVAL_REJECT_THRESHOLD", "0.62"))
+# Igual que SHORT_ANSWER_WORDS en core_service/app/core/evaluation.py.
+SHORT_ANSWER_WORDS = 2
+# Distancia mínima entre un umbral y la respuesta etiquetada más cercana del lado equivocado.
+CALIBRATION_MARGIN = 0.02
+
+def normalize_output_text(text: str) -> list:
+    """
+    Igual que logic.normalize_output_text: sin acentos, sin puntuación y en minúsculas.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    without_accents = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return re.findall(r"\w+", without_accents.casefold())
+
+def may_accept_locally(answer: str, question: dict) -> bool:
+    """
+    Mismo filtro que evaluation._may_accept_locally: las respuestas cortas solo se aprueban sin el LLM
+    si coinciden con una referencia; si no, el servicio las envía al LLM sea cual sea su similitud.
+    """
+    answer_tokens = normalize_output_text(answer)
+    if len(answer_tokens) > SHORT_ANSWER_WORDS:
+        return True
+    return any(answer_tokens == normalize_output_text(ref) for ref in question["references"])
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+def best_similarities(embeddings, bank: dict, labeled: list) -> np.ndarray:
+    """
+    Similitud coseno de cada respuesta etiquetada contra la mejor referencia de su pregunta,
+    igual que evaluation.best_reference_similarity en el core_service.
+    """
+    references = [(q_index, ref) for q_index, question in enumerate(bank["questions"]) for ref in question["references"]]
+    ref_matrix = _normalize_rows(np.asarray(embed_with_retry(embeddings, [ref for _, ref in references]), dtype=np.float32))
+    ref_owner = np.asarray([q_index for q_index, _ in references])
+    answers = _normalize_rows(np.asarray(embed_with_retry(embeddings, [item["answer"] for item in labeled]), dtype=np.float32))
+    similarities = answers @ ref_matrix.T
+    owns = ref_owner[None, :] == np.asarray([item["question"] for item in labeled])[:, None]
+    return np.where(owns, similarities, -np.inf).max(axis=1)
+
+def calibrate_question(similarities: np.ndarray, correct: np.ndarray, acceptable: np.ndarray) -> tuple:
+    """
+    Umbral de aceptación justo por encima de la respuesta incorrecta más parecida que el servicio
+    podría aprobar localmente (`acceptable`) y de rechazo justo por debajo de la correcta menos
+    parecida, para que ninguna respuesta etiquetada se califique mal localmente (la franja
+    intermedia va al LLM).
+    """
+    risky = ~correct & acceptable
+    accept = min(float(similarities[risky].max()) + CALIBRATION_MARGIN, 1.0) if risky.any() else DEFAULT_ACCEPT_THRESHOLD
+    reject = max(float(similarities[correct].min()) - CALIBRATION_MARGIN, 0.0) if correct.any() else DEFAULT_REJECT_THRESHOLD
+    return round(accept, 3), round(min(reject, accept), 3)
+
+def main():
+    """
+    Calibra los umbrales de calificación local de un día contra su conjunto etiquetado.
+    Sale con código 1 si con los umbrales actuales alguna respuesta incorrecta se aprobaría
+    (o alguna correcta se rechazaría) sin pasar por el LLM.
+    """
+    parser = argparse.ArgumentParser(description="Calibra los umbrales de similitud de la evaluación de un día.")
+    parser.add_argument("--day", type=int, default=1)
+    parser.add_argument("--write", action="store_true", help="Guarda los umbrales sugeridos en el banco fuente.")
+    args = parser.parse_args()
+
+    bank_path = os.path.join(EVALUATION_SOURCE_DIRECTORY, f"dia_{args.day}.json")
+    calibration_path = os.path.join(EVALUATION_SOURCE_DIRECTORY, f"calibracion_dia_{args.day}.json")
+    with open(bank_path, encoding="utf-8") as f:
+        bank = json.load(f)
+    with open(calibration_path, encoding="utf-8") as f:
+        labeled = json.load(f)["answers"]
+
+    # Las respuestas vacías el servicio las rechaza sin embeddings: solo cuentan como error si son correctas.
+    empty_correct = sum(1 for item in labeled if not item["answer"].strip() and item["correct"])
+    labeled = [item for item in labeled if item["answer"].strip()]
+
+    similarities = best_similarities(get_embeddings_local(), bank, labeled)
+    question_of = np.asarray([item["question"] for item in labeled])
+    correct = np.asarray([item["correct"] for item in labeled])
+
+    acceptable = np.asarray([may_accept_locally(item["answer"], bank["questions"][item["question"]]) for item in labeled])
+
+    mistakes = empty_correct
+    for q_index, question in enumerate(bank["questions"]):
+        mask = question_of == q_index
+        q_similarities, q_correct, q_acceptable = similarities[mask], correct[mask], acceptable[mask]
+        accept = question.get("accept_threshold", bank.get("accept_threshold", DEFAULT_ACCEPT_THRESHOLD))
+        reject = question.get("reject_threshold", bank.get("reject_threshold", DEFAULT_REJECT_THRESHOLD))
+        local_accepts = (q_similarities >= accept) & q_acceptable
+        false_accepts = int((local_accepts & ~q_correct).sum())
+        false_rejects = int(((q_similarities <= reject) & q_correct).sum())
+        local = int((local_accepts | (q_similarities <= reject)).sum())
+        mistakes += false_accepts + false_rejects
+        suggested_accept, suggested_reject = calibrate_question(q_similarities, q_correct, q_acceptable)
+
+        print(f"\nPregunta {q_index + 1}: {question['q']}")
+        for item, similarity in zip([item for item, m in zip(labeled, mask) if m], q_similarities):
+            print(f"  {similarity:.3f}  {'correcta  ' if item['correct'] else 'incorrecta'}  {item['answer']}")
+        print(f"  Umbrales actuales: aceptar >= {accept}, rechazar <= {reject} -> "
+              f"{local}/{len(q_similarities)} locales, {false_accepts} falsos aprobados, {false_rejects} falsos rechazos")
+        print(f"  Umbrales sugeridos: aceptar >= {suggested_accept}, rechazar <= {suggested_reject}")
+        if args.write:
+            question["accept_threshold"], question["reject_threshold"] = suggested_accept, suggested_reject
+
+    if args.write:
+        with open(bank_path, "w", encoding="utf-8") as f:
+            json.dump(bank, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\nUmbrales guardados en {bank_path}. Vuelve a ejecutar preprocess_documents.py para publicarlos.")
+
+    if mistakes and not args.write:
+        print(f"\n{mistakes} respuestas etiquetadas se calificarían mal localmente con los umbrales actuales.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+from typing import Dict, List
+from app.core import metrics
+from app.core.pipeline import process_update, process_message, send_answer, get_update_chat_id, get_update_user_name
+from app.core.rate_limit import TokenBucket
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Turnos por segundo que puede iniciar cada chat y ráfaga permitida.
+ADMISSION_CHAT_RATE = float(os.getenv("ADMISSION_CHAT_RATE", "0.2"))
+ADMISSION_CHAT_BURST = float(os.getenv("ADMISSION_CHAT_BURST", "3"))
+# Ventana en la que los mensajes seguidos de un mismo chat se juntan en un solo turno.
+ADMISSION_COALESCE_WINDOW = float(os.getenv("ADMISSION_COALESCE_WINDOW", "1.5"))
+# Máximo de chats con un turno en espera o en curso antes de descartar mensajes nuevos.
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "200"))
+# Cada cuánto se descartan los token buckets de chats inactivos con el bucket lleno.
+ADMISSION_BUCKET_SWEEP_INTERVAL = float(os.getenv("ADMISSION_BUCKET_SWEEP_INTERVAL", "60"))
+# Tiempo máximo que el apagado espera a que terminen los turnos admitidos.
+ADMISSION_DRAIN_TIMEOUT = float(os.getenv("ADMISSION_DRAIN_TIMEOUT", "30"))
+ADMISSION_SHED_MESSAGE = os.getenv(
+    "ADMISSION_SHED_MESSAGE",
+    "¡Dame un momento! Estoy atendiendo a muchas Tyzys a la vez. Escríbeme de nuevo en un minuto, por favor 🙏"
+)
+
+
+class _PendingTurn:
+    def __init__(self, user_name: str):
+        self.texts: List[str] = []
+        self.user_name = user_name
+        self.futures: List[asyncio.Future] = []
+
+
+class AdmissionController:
+    """
+    Controla qué mensajes llegan al core_service:
+
+    - Los mensajes seguidos de un mismo chat dentro de la ventana (o mientras su turno anterior
+      sigue en curso) se juntan en un solo turno.
+    - Cada chat tiene un token bucket: si lo agota, su siguiente turno espera a tener token.
+    - Si hay demasiados chats con turnos pendientes, los mensajes de chats nuevos se descartan
+      con una respuesta amable en lugar de encolarse sin límite.
+
+    Los turnos de un mismo chat siempre se procesan en orden.
+    """
+
+    def __init__(self):
+        self._pending: Dict[object, _PendingTurn] = {}
+        self._last_turn: Dict[object, asyncio.Task] = {}
+        self._buckets: Dict[object, TokenBucket] = {}
+        self._tasks = set()
+        self._last_sweep = time.monotonic()
+
+    def inflight(self) -> int:
+        return len(self._last_turn)
+
+    def submit(self, update: dict) -> asyncio.Future:
+        """
+        Admite un update y devuelve un future que termina cuando el turno que lo incluye se procesó.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        chat_id = get_update_chat_id(update)
+        text = update.get("message", {}).get("text", "")
+
+        if not ADMISSION_ENABLED or chat_id is None or not text:
+            if chat_id is None:
+                self._spawn(self._process_directly(update, future))
+            else:
+                # Sin control de admisión cada update es su propio turno, pero en orden dentro del chat.
+                previous_turn = self._last_turn.get(chat_id)
+                self._last_turn[chat_id] = self._spawn(self._process_directly(update, future, chat_id, previous_turn))
+            return future
+
+        metrics.incr("messages_received")
+        self._sweep_buckets()
+        pending = self._pending.get(chat_id)
+        if pending:
+            pending.texts.append(text)
+            pending.futures.append(future)
+            metrics.incr("messages_coalesced")
+            return future
+
+        if chat_id not in self._last_turn and self.inflight() >= ADMISSION_MAX_INFLIGHT:
+            metrics.incr("messages_shed")
+            self._spawn(self._shed(chat_id, future))
+            return future
+
+        pending = _PendingTurn(get_update_user_name(update))
+        pending.texts.append(text)
+        pending.futures.append(future)
+        self._pending[chat_id] = pending
+        previous_turn = self._last_turn.get(chat_id)
+        self._last_turn[chat_id] = self._spawn(self._run_turn(chat_id, previous_turn))
+        return future
+
+    def _sweep_buckets(self) -> None:
+        """
+        Descarta los buckets llenos de chats sin turno pendiente ni en curso: un bucket nuevo
+        se comporta igual, así la memoria no crece con cada chat que escribió alguna vez.
+        """
+        now = time.monotonic()
+        if now - self._last_sweep < ADMISSION_BUCKET_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        idle = [chat_id for chat_id, bucket in self._buckets.items()
+                if chat_id not in self._last_turn and bucket.is_full()]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+
+    async def drain(self, timeout: float = ADMISSION_DRAIN_TIMEOUT) -> None:
+        """
+        Espera a que terminen los turnos ya admitidos (el webhook respondió 200 antes de procesarlos,
+        así que Telegram no los volverá a enviar). Se llama al apagar el servicio.
+        """
+        turns = list(self._last_turn.values())
+        if not turns:
+            return
+        print(f"Esperando {len(turns)} turnos en curso antes de apagar (máximo {timeout}s)...")
+        _, not_done = await asyncio.wait(turns, timeout=timeout)
+        if not_done:
+            metrics.incr("turns_lost_on_shutdown", len(not_done))
+            print(f"Advertencia: {len(not_done)} turnos no terminaron antes de apagar y se perderán.")
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _process_directly(self, update: dict, future: asyncio.Future, chat_id=None, previous_turn=None) -> None:
+        try:
+            if previous_turn:
+                await asyncio.gather(previous_turn, return_exceptions=True)
+            future.set_result(await process_update(update))
+        except Exception as e:
+            print(f"Error procesando el update {update.get('update_id')}: {e}")
+            future.set_result("error")
+        finally:
+            if chat_id is not None and self._last_turn.get(chat_id) is asyncio.current_task():
+                del self._last_turn[chat_id]
+
+    async def _shed(self, chat_id, future: asyncio.Future) -> None:
+        await send_answer(chat_id, ADMISSION_SHED_MESSAGE)
+        future.set_result("shed")
+
+    async def _run_turn(self, chat_id, previous_turn) -> None:
+        pending = self._pending[chat_id]
+        try:
+            await asyncio.sleep(ADMISSION_COALESCE_WINDOW)
+            if previous_turn:
+                await asyncio.gather(previous_turn, return_exceptions=True)
+
+            bucket = self._buckets.setdefault(chat_id, TokenBucket(ADMISSION_CHAT_RATE, capacity=ADMISSION_CHAT_BURST))
+            if not bucket.try_acquire():
+                metrics.incr("messages_throttled", len(pending.texts))
+                await bucket.acquire()
+
+            # A partir de aquí los mensajes nuevos del chat van al siguiente turno.
+            del self._pending[chat_id]
+            if len(pending.texts) > 1:
+                metrics.incr("turns_coalesced")
+            metrics.incr("turns_processed")
+            await process_message(chat_id, "\n".join(pending.texts), pending.user_name)
+            result = "ok"
+        except Exception as e:
+            print(f"Error procesando el turno del chat {chat_id}: {e}")
+            if self._pending.get(chat_id) is pending:
+                del self._pending[chat_id]
+            result = "error"
+        finally:
+            if self._last_turn.get(chat_id) is asyncio.current_task():
+                del self._last_turn[chat_id]
+
+        for future in pending.futures:
+            if not future.done():
+                future.set_result(result)
+
+
+admission_controller = AdmissionController()
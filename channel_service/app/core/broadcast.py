@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import asyncio
+import requests
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter, TelegramError
+from app.core.telegram_bot import get_bot
+from app.core.rate_limit import TokenBucket
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CORE_SERVICE_URL = os.getenv("CORE_SERVICE_URL", "http://core_service:8002")
+# Telegram admite ~30 mensajes/s en total y ~1 mensaje/s por chat.
+BROADCAST_GLOBAL_RATE = float(os.getenv("BROADCAST_GLOBAL_RATE", "28"))
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "50"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "5"))
+# Envíos que se confirman juntos al core_service. Pequeño, para que una estudiante que responde
+# enseguida a la apertura ya tenga su sesión marcada (a 28 mensajes/s, 10 envíos son ~0.4 s).
+BROADCAST_ACK_BATCH = int(os.getenv("BROADCAST_ACK_BATCH", "10"))
+BROADCAST_STATE_DIR = os.getenv("BROADCAST_STATE_DIR", "./broadcast_state")
+# Hora local del contenedor (HH:MM) del envío diario. Vacío desactiva el programador.
+BROADCAST_TIME = os.getenv("BROADCAST_TIME", "")
+
+broadcast_status: Dict[str, object] = {"running": False, "last_run": None}
+
+
+class RateLimitedSender:
+    """
+    Envía mensajes respetando el límite global y por chat de Telegram con token buckets.
+    Ante un 429 detiene todo el envío durante `retry_after` y reintenta.
+    """
+
+    def __init__(self, bot, global_rate: float = BROADCAST_GLOBAL_RATE, per_chat_rate: float = BROADCAST_PER_CHAT_RATE,
+                 max_retries: int = BROADCAST_MAX_RETRIES):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+
+    async def send(self, chat_id: int, text: str) -> bool:
+        chat_bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.per_chat_rate, capacity=1))
+        for attempt in range(self.max_retries + 1):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+                self.sent += 1
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                self.throttled += 1
+                print(f"Telegram pidió esperar {retry_after}s (chat {chat_id}).")
+                self.global_bucket.pause(retry_after)
+                chat_bucket.pause(retry_after)
+            except (Forbidden, BadRequest) as e:
+                # La usuaria bloqueó el bot o el chat ya no existe: no tiene sentido reintentar.
+                print(f"No se puede enviar al chat {chat_id}: {e}")
+                break
+            except NetworkError as e:
+                print(f"Error de red enviando al chat {chat_id} (intento {attempt + 1}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError as e:
+                print(f"Error de Telegram enviando al chat {chat_id}: {e}")
+                break
+        self.failed += 1
+        return False
+
+
+def _journal_path(run_date: date) -> str:
+    return os.path.join(BROADCAST_STATE_DIR, f"broadcast_{run_date.isoformat()}.log")
+
+def _checkpoint_path(run_date: date) -> str:
+    return os.path.join(BROADCAST_STATE_DIR, f"broadcast_{run_date.isoformat()}.json")
+
+def load_checkpoint(run_date: date) -> dict:
+    try:
+        with open(_checkpoint_path(run_date), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"date": run_date.isoformat(), "after_id": 0, "completed": False}
+
+def save_checkpoint(run_date: date, checkpoint: dict) -> None:
+    path = _checkpoint_path(run_date)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def load_journal(run_date: date) -> set:
+    try:
+        with open(_journal_path(run_date), encoding="utf-8") as f:
+            return {int(line) for line in f if line.strip()}
+    except OSError:
+        return set()
+
+def fetch_roster(after_id: int, limit: int) -> List[dict]:
+    response = requests.get(
+        f"{CORE_SERVICE_URL}/conversation/broadcast-roster", params={"after_id": after_id, "limit": limit}, timeout=60
+    )
+    response.raise_for_status()
+    return response.json()
+
+def acknowledge(telegram_ids: List[int]) -> None:
+    if not telegram_ids:
+        return
+    response = requests.post(
+        f"{CORE_SERVICE_URL}/conversation/broadcast-ack", json={"telegram_ids": telegram_ids}, timeout=60
+    )
+    response.raise_for_status()
+
+async def run_daily_broadcast(run_date: Optional[date] = None) -> dict:
+    """
+    Ejecuta el envío diario marcándolo como en curso para que no se lancen dos a la vez.
+    """
+    broadcast_status["running"] = True
+    try:
+        return await _broadcast_day(run_date or date.today())
+    finally:
+        broadcast_status["running"] = False
+
+async def _broadcast_day(run_date: date) -> dict:
+    """
+    Envía la apertura de la lección del día a todas las estudiantes activas.
+
+    El avance se guarda en BROADCAST_STATE_DIR: un checkpoint con el último telegram_id de la última
+    página terminada y un diario con cada chat ya enviado. Si el proceso se cae, volver a ejecutar
+    el envío del mismo día continúa donde quedó sin repetir mensajes.
+    """
+    os.makedirs(BROADCAST_STATE_DIR, exist_ok=True)
+    checkpoint = load_checkpoint(run_date)
+    if checkpoint.get("completed"):
+        print(f"El envío del {run_date} ya se completó.")
+        return checkpoint
+
+    already_sent = load_journal(run_date)
+    # Confirma al core_service los envíos que quedaron sin confirmar antes de una caída.
+    pending_ack = [chat_id for chat_id in already_sent if chat_id > checkpoint["after_id"]]
+    await asyncio.to_thread(acknowledge, pending_ack)
+
+    sender = RateLimitedSender(get_bot())
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    started = time.perf_counter()
+    unacknowledged: List[int] = []
+
+    async def flush_acks(required: bool = False) -> None:
+        batch = unacknowledged[:]
+        del unacknowledged[:len(batch)]
+        try:
+            await asyncio.to_thread(acknowledge, batch)
+        except Exception as e:
+            # Se reintentan en la siguiente confirmación; al cerrar la página la confirmación es obligatoria.
+            unacknowledged.extend(batch)
+            if required:
+                raise
+            print(f"Error confirmando {len(batch)} envíos, se reintentará: {e}")
+
+    try:
+        with open(_journal_path(run_date), "a", encoding="utf-8") as journal:
+            async def send_one(entry: dict) -> None:
+                async with semaphore:
+                    if await sender.send(entry["telegram_id"], entry["text"]):
+                        journal.write(f"{entry['telegram_id']}\n")
+                        journal.flush()
+                        # Se confirma justo después del envío para que su respuesta continúe la lección.
+                        unacknowledged.append(entry["telegram_id"])
+                        if len(unacknowledged) >= BROADCAST_ACK_BATCH:
+                            await flush_acks()
+
+            while True:
+                roster = await asyncio.to_thread(fetch_roster, checkpoint["after_id"], BROADCAST_PAGE_SIZE)
+                if not roster:
+                    break
+                to_send = [entry for entry in roster if entry["telegram_id"] not in already_sent]
+                await asyncio.gather(*(send_one(entry) for entry in to_send))
+                await flush_acks(required=True)
+
+                checkpoint["after_id"] = roster[-1]["telegram_id"]
+                save_checkpoint(run_date, checkpoint)
+                elapsed = time.perf_counter() - started
+                print(f"Envío diario: {sender.sent} enviados, {sender.failed} fallidos, "
+                      f"{sender.sent / max(elapsed, 1e-6):.1f} mensajes/s.")
+
+        checkpoint["completed"] = True
+        save_checkpoint(run_date, checkpoint)
+    finally:
+        elapsed = time.perf_counter() - started
+        broadcast_status["last_run"] = {
+            "date": run_date.isoformat(),
+            "sent": sender.sent,
+            "failed": sender.failed,
+            "throttled": sender.throttled,
+            "seconds": round(elapsed, 2),
+            "messages_per_second": round(sender.sent / max(elapsed, 1e-6), 2),
+            "completed": checkpoint.get("completed", False),
+        }
+    print(f"Envío diario terminado: {broadcast_status['last_run']}")
+    return broadcast_status["last_run"]
+
+async def run_scheduler(stop_event: asyncio.Event) -> None:
+    """
+    Lanza el envío diario a la hora BROADCAST_TIME. Si el servicio arranca después de esa hora y el
+    envío del día no terminó (por ejemplo tras una caída), lo retoma de inmediato.
+    """
+    hour, minute = (int(part) for part in BROADCAST_TIME.split(":"))
+    print(f"Programador del envío diario activo ({BROADCAST_TIME}).")
+    while not stop_event.is_set():
+        now = datetime.now()
+        scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if now >= scheduled and not broadcast_status["running"] and not load_checkpoint(now.date()).get("completed"):
+            try:
+                await run_daily_broadcast(now.date())
+            except Exception as e:
+                print(f"Error en el envío diario: {e}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=60)
+        except asyncio.TimeoutError:
+            pass
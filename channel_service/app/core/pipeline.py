@@ -0,0 +1,91 @@
+import os
+import asyncio
+import requests
+from app.core.telegram_bot import get_bot
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RAG_CONVERSATION_URL = os.getenv("CORE_SERVICE_URL", "http://core_service:8002") + "/conversation/query"
+
+# Sesión HTTP compartida para reutilizar conexiones con el core_service entre mensajes.
+_core_session = requests.Session()
+
+def get_update_chat_id(update: dict):
+    """
+    Devuelve el chat_id de un update de Telegram, o None si no es un mensaje.
+    """
+    return update.get("message", {}).get("chat", {}).get("id")
+
+def get_update_user_name(update: dict) -> str:
+    return update.get("message", {}).get("from", {}).get("first_name", "Usuario Anónimo")
+
+def ask_core_service(chat_id, text: str, user_name: str) -> str:
+    """
+    Envía la pregunta al core_service y devuelve la respuesta para la usuaria (o un mensaje de error amable).
+    """
+    payload = {
+        "phone_number": str(chat_id),
+        "question": text,
+        "user_name": user_name,
+        "conversation_id": None
+    }
+
+    answer = "Lo siento, no pude procesar tu consulta en este momento."
+    try:
+        print(f"Sending payload to RAG service: {payload}")
+        response = _core_session.post(RAG_CONVERSATION_URL, json=payload, timeout=45)
+        print(f"RAG service response status: {response.status_code}")
+        if response.status_code == 200:
+            data = response.json()
+            print(f"RAG service response data: {data}")
+            answer = data.get("answer", answer)
+        else:
+            error_detail = response.text[:500]
+            print(f"Error from RAG service ({response.status_code}): {error_detail}")
+            answer = f"Lo siento, ocurrió un error ({response.status_code}) al comunicarme con el servicio de conversación."
+    except requests.exceptions.Timeout:
+        print("Timeout calling RAG service.")
+        answer = "Lo siento, el servicio de conversación tardó demasiado en responder."
+    except requests.exceptions.RequestException as e:
+        print(f"RequestException calling RAG service: {e}")
+        answer = f"Error en la comunicación con el servicio de conversación."
+    except Exception as e:
+        print(f"Unexpected error during RAG service call: {e}")
+        answer = f"Error inesperado procesando tu solicitud."
+    return answer
+
+async def send_answer(chat_id, answer: str) -> None:
+    """
+    Envía la respuesta a la usuaria por Telegram.
+    """
+    try:
+        answer = answer.replace('\\n', '\n')
+        await get_bot().send_message(chat_id=chat_id, text=answer, parse_mode='HTML')
+        print(f"Message sent to chat_id {chat_id}: {answer[:100]}...")
+    except Exception as e:
+        print(f"Error sending message via Telegram, chat_id {chat_id}: {e}")
+
+async def process_update(update: dict) -> str:
+    """
+    Procesa un update de Telegram completo: consulta al core_service y responde a la usuaria.
+    Lo usan tanto el webhook como el modo de long polling.
+    """
+    if "message" not in update:
+        return "ignored"
+
+    message = update["message"]
+    text = message.get("text", "")
+    if not text:
+        return "no text message"
+
+    await process_message(message["chat"]["id"], text, get_update_user_name(update))
+    return "ok"
+
+async def process_message(chat_id, text: str, user_name: str) -> None:
+    """
+    Un turno de conversación: consulta al core_service y responde a la usuaria.
+    """
+    # La llamada al core_service es bloqueante: se hace en un hilo para no frenar el event loop.
+    answer = await asyncio.to_thread(ask_core_service, chat_id, text, user_name)
+    await send_answer(chat_id, answer)
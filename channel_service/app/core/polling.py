@@ -0,0 +1,72 @@
+import os
+import time
+import asyncio
+from typing import Dict, List
+from app.core.telegram_bot import get_bot
+from app.core.admission import admission_controller
+from app.core.pipeline import get_update_chat_id
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGESTION_MODE = os.getenv("INGESTION_MODE", "webhook")
+POLLING_BATCH_SIZE = min(int(os.getenv("POLLING_BATCH_SIZE", "100")), 100)
+POLLING_CONCURRENCY = int(os.getenv("POLLING_CONCURRENCY", "16"))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "30"))
+POLLING_ERROR_BACKOFF = float(os.getenv("POLLING_ERROR_BACKOFF", "5"))
+
+async def process_batch(updates: List[dict], concurrency: int = POLLING_CONCURRENCY) -> None:
+    """
+    Procesa un lote de updates: chats distintos en paralelo (hasta `concurrency`) y,
+    dentro de un mismo chat, en el orden en que llegaron.
+    """
+    updates_by_chat: Dict[object, List[dict]] = {}
+    for update in updates:
+        updates_by_chat.setdefault(get_update_chat_id(update), []).append(update)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process_chat(chat_updates: List[dict]):
+        async with semaphore:
+            # Se admiten todos a la vez para que el control de admisión pueda juntarlos en un turno;
+            # el orden dentro del chat lo garantiza el propio control de admisión (también si está desactivado).
+            await asyncio.gather(*(admission_controller.submit(update) for update in chat_updates))
+
+    await asyncio.gather(*(process_chat(chat_updates) for chat_updates in updates_by_chat.values()))
+
+async def run_polling(stop_event: asyncio.Event) -> None:
+    """
+    Recibe updates con getUpdates (long polling) en lotes. El offset solo avanza cuando el lote
+    completo se procesó, así un reinicio a mitad de lote vuelve a entregar esos mensajes.
+    """
+    bot = get_bot()
+    await bot.delete_webhook(drop_pending_updates=False)
+    print(f"Long polling iniciado (lote={POLLING_BATCH_SIZE}, concurrencia={POLLING_CONCURRENCY}).")
+
+    offset = None
+    while not stop_event.is_set():
+        try:
+            updates = await bot.get_updates(
+                offset=offset, limit=POLLING_BATCH_SIZE, timeout=POLLING_TIMEOUT, allowed_updates=["message"]
+            )
+        except Exception as e:
+            print(f"Error en getUpdates: {e}. Reintentando en {POLLING_ERROR_BACKOFF}s.")
+            await asyncio.sleep(POLLING_ERROR_BACKOFF)
+            continue
+
+        if not updates:
+            continue
+
+        started = time.perf_counter()
+        await process_batch([update.to_dict() for update in updates])
+        elapsed = time.perf_counter() - started
+        # Telegram confirma los updates anteriores a `offset` en la siguiente llamada a getUpdates.
+        offset = updates[-1].update_id + 1
+        print(f"Lote de {len(updates)} updates procesado en {elapsed:.2f}s ({len(updates) / max(elapsed, 1e-6):.1f} updates/s).")
+
+    if offset is not None:
+        try:
+            await bot.get_updates(offset=offset, limit=1, timeout=0)
+        except Exception as e:
+            print(f"No se pudo confirmar el último offset al detener el polling: {e}")
+    print("Long polling detenido.")
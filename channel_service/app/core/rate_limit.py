@@ -0,0 +1,66 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    """
+    Token bucket para limitar la tasa de mensajes. `rate` tokens por segundo con ráfagas de hasta `capacity`.
+    Pensado para usarse desde un único event loop (no hay await entre consultar y consumir tokens).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        Consume tokens si hay disponibles, sin esperar.
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """
+        Espera hasta que haya tokens disponibles y los consume.
+        """
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        """
+        Indica si el bucket recuperó toda su capacidad (equivale a uno recién creado).
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds: float) -> None:
+        """
+        Bloquea el bucket durante `seconds` (por ejemplo, tras un 429 con retry_after) y lo vacía.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated_at = self.paused_until
@@ -1,12 +1,34 @@
 import os
+from typing import Optional
 from telegram import Bot
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 
 load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Permite apuntar a una Bot API propia o falsa (staging, pruebas de carga).
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+# El envío masivo, el polling y las respuestas comparten el Bot: el pool de conexiones debe cubrir
+# los envíos concurrentes de todos (por defecto BROADCAST_CONCURRENCY + POLLING_CONCURRENCY + margen).
+TELEGRAM_CONNECTION_POOL_SIZE = int(os.getenv(
+    "TELEGRAM_CONNECTION_POOL_SIZE",
+    str(int(os.getenv("BROADCAST_CONCURRENCY", "50")) + int(os.getenv("POLLING_CONCURRENCY", "16")) + 8)
+))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "10"))
+
+_bot: Optional[Bot] = None
 
 def get_bot() -> Bot:
+    global _bot
     if not TELEGRAM_BOT_TOKEN:
         raise ValueError("TELEGRAM_BOT_TOKEN no está configurado en el entorno.")
-    return Bot(token=TELEGRAM_BOT_TOKEN)
\ No newline at end of file
+    if _bot is None:
+        _bot = Bot(
+            token=TELEGRAM_BOT_TOKEN,
+            base_url=TELEGRAM_API_BASE_URL,
+            request=HTTPXRequest(connection_pool_size=TELEGRAM_CONNECTION_POOL_SIZE, pool_timeout=TELEGRAM_POOL_TIMEOUT),
+            # getUpdates usa su propia conexión para que el long polling no ocupe una del pool de envíos.
+            get_updates_request=HTTPXRequest(connection_pool_size=1),
+        )
+    return _bot
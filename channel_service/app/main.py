@@ -1,5 +1,8 @@
+import asyncio
 from fastapi import FastAPI
-from app.routes import telegram
+from app.routes import telegram, broadcast as broadcast_routes
+from app.core import polling, broadcast, metrics
+from app.core.admission import admission_controller
 
 app = FastAPI(
     title="Channel Service",
@@ -7,10 +10,38 @@ app = FastAPI(
 )
 
 app.include_router(telegram.router)
+app.include_router(broadcast_routes.router, prefix="/broadcast", tags=["Broadcast"])
+
+_stop_event = None
+_background_tasks = []
+
+@app.on_event("startup")
+async def on_startup():
+    global _stop_event
+    _stop_event = asyncio.Event()
+    if polling.INGESTION_MODE == "polling":
+        _background_tasks.append(asyncio.create_task(polling.run_polling(_stop_event)))
+    if broadcast.BROADCAST_TIME:
+        _background_tasks.append(asyncio.create_task(broadcast.run_scheduler(_stop_event)))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if _background_tasks:
+        _stop_event.set()
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+    # Con el polling detenido ya no entran mensajes: se terminan los turnos admitidos.
+    await admission_controller.drain()
 
 @app.get("/", tags=["Health Check"])
 def read_root():
     """
     Endpoint de verificación para saber si el servicio está funcionando.
     """
-    return {"status": "Channel Service está funcionando"}
\ No newline at end of file
+    return {"status": "Channel Service está funcionando"}
+
+@app.get("/metrics", tags=["Health Check"])
+def read_metrics():
+    """
+    Métricas del control de admisión (mensajes limitados, agrupados y descartados) y turnos en curso.
+    """
+    return {**metrics.snapshot(), "inflight_chats": admission_controller.inflight()}
@@ -0,0 +1,26 @@
+import asyncio
+from fastapi import APIRouter, HTTPException
+from app.core import broadcast
+
+router = APIRouter()
+
+_broadcast_tasks = set()
+
+@router.post("/daily")
+async def start_daily_broadcast():
+    """
+    Lanza (o retoma) en segundo plano el envío de la apertura de la lección de hoy.
+    """
+    if broadcast.broadcast_status["running"]:
+        raise HTTPException(status_code=409, detail="Ya hay un envío diario en curso.")
+    task = asyncio.create_task(broadcast.run_daily_broadcast())
+    _broadcast_tasks.add(task)
+    task.add_done_callback(_broadcast_tasks.discard)
+    return {"status": "started"}
+
+@router.get("/status")
+def get_broadcast_status():
+    """
+    Estado del envío diario: si está en curso y los números de la última ejecución (incluye mensajes/s).
+    """
+    return broadcast.broadcast_status
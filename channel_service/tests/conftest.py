@@ -0,0 +1,131 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+import pytest
+from app.core import broadcast, pipeline, telegram_bot
+
+TOKEN = "123:TEST"
+
+
+class FakeTelegramAPI:
+    """
+    Bot API y core_service falsos en un servidor HTTP local. Guarda cada llamada para que las
+    pruebas comprueben el orden y el ritmo de los envíos.
+    """
+
+    def __init__(self):
+        self.updates = []
+        self.get_updates_calls = []
+        self.sent = []
+        self.acks = []
+        self.roster = []
+        # Respuestas 429 programadas: chat_id -> lista de retry_after a devolver antes de aceptar.
+        self.retry_after = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def add_message(self, chat_id: int, text: str) -> None:
+        update_id = len(self.updates) + 1
+        self.updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Ana"},
+            },
+        })
+
+    def sent_texts(self, chat_id: int) -> list:
+        return [sent["text"] for sent in self.sent if sent["chat_id"] == chat_id]
+
+    def _handle(self, path: str, params: dict):
+        method = path.rsplit("/", 1)[-1]
+        with self.lock:
+            if method == "getUpdates":
+                offset = int(params.get("offset") or 0)
+                limit = int(params.get("limit") or 100)
+                self.get_updates_calls.append({"offset": offset, "limit": limit, "sent_before": len(self.sent)})
+                return True, [update for update in self.updates if update["update_id"] >= offset][:limit]
+            if method == "deleteWebhook":
+                return True, True
+            if method == "sendMessage":
+                chat_id = int(params["chat_id"])
+                pending = self.retry_after.get(chat_id)
+                if pending:
+                    return False, {"error_code": 429, "description": "Too Many Requests",
+                                   "parameters": {"retry_after": pending.pop(0)}}
+                self.sent.append({"chat_id": chat_id, "text": params["text"], "at": time.monotonic()})
+                message = {"message_id": len(self.sent), "date": int(time.time()), "text": params["text"],
+                           "chat": {"id": chat_id, "type": "private"}}
+                return True, message
+            if path == "/conversation/query":
+                return None, {"answer": f"eco: {params['question']}"}
+            if path == "/conversation/broadcast-roster":
+                after_id, limit = int(params["after_id"]), int(params["limit"])
+                return None, [entry for entry in self.roster if entry["telegram_id"] > after_id][:limit]
+            if path == "/conversation/broadcast-ack":
+                self.acks.extend(params["telegram_ids"])
+                return None, {"acknowledged": len(params["telegram_ids"])}
+        raise KeyError(path)
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, params: dict):
+                try:
+                    ok, result = api._handle(urlparse(self.path).path, params)
+                except KeyError:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if ok is None:
+                    body, status = result, 200
+                elif ok:
+                    body, status = {"ok": True, "result": result}, 200
+                else:
+                    body, status = {"ok": False, **result}, result["error_code"]
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond(dict(parse_qsl(urlparse(self.path).query)))
+
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(raw or "{}")
+                else:
+                    params = dict(parse_qsl(raw))
+                self._respond(params)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def fake_api(monkeypatch, tmp_path):
+    api = FakeTelegramAPI()
+    api.thread.start()
+    monkeypatch.setattr(telegram_bot, "TELEGRAM_BOT_TOKEN", TOKEN)
+    monkeypatch.setattr(telegram_bot, "TELEGRAM_API_BASE_URL", f"{api.base_url}/bot")
+    monkeypatch.setattr(telegram_bot, "_bot", None)
+    monkeypatch.setattr(pipeline, "RAG_CONVERSATION_URL", f"{api.base_url}/conversation/query")
+    monkeypatch.setattr(broadcast, "CORE_SERVICE_URL", api.base_url)
+    monkeypatch.setattr(broadcast, "BROADCAST_STATE_DIR", str(tmp_path / "broadcast_state"))
+    yield api
+    api.server.shutdown()
+    api.server.server_close()
@@ -0,0 +1,31 @@
+import asyncio
+import random
+from app.core import admission
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "from": {"first_name": "Ana"}, "text": text}}
+
+
+def test_updates_of_a_chat_keep_their_order_without_admission(monkeypatch):
+    processed = []
+
+    async def fake_process_update(update):
+        # Los primeros mensajes tardan más: si se procesaran en paralelo llegarían desordenados.
+        await asyncio.sleep(random.uniform(0.01, 0.03) * (5 - update["update_id"] % 5))
+        processed.append((update["message"]["chat"]["id"], update["message"]["text"]))
+        return "ok"
+
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", False)
+    monkeypatch.setattr(admission, "process_update", fake_process_update)
+
+    async def run():
+        controller = admission.AdmissionController()
+        updates = [make_update(i, chat_id, f"{chat_id}-{i}") for i in range(5) for chat_id in (1, 2)]
+        results = await asyncio.gather(*(controller.submit(update) for update in updates))
+        assert results == ["ok"] * len(updates)
+        assert controller.inflight() == 0
+
+    asyncio.run(run())
+    for chat_id in (1, 2):
+        assert [text for chat, text in processed if chat == chat_id] == [f"{chat_id}-{i}" for i in range(5)]
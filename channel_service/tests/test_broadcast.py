@@ -0,0 +1,62 @@
+import asyncio
+import time
+from datetime import date
+from app.core import broadcast
+from app.core.telegram_bot import get_bot
+
+RUN_DATE = date(2026, 1, 5)
+
+
+def make_roster(chat_ids):
+    return [{"telegram_id": chat_id, "text": f"Apertura {chat_id}"} for chat_id in chat_ids]
+
+
+def test_retry_after_pauses_and_retries(fake_api):
+    fake_api.roster = make_roster([1, 2, 3])
+    fake_api.retry_after[2] = [1]
+
+    started = time.monotonic()
+    result = asyncio.run(broadcast.run_daily_broadcast(RUN_DATE))
+
+    assert result["sent"] == 3 and result["failed"] == 0 and result["throttled"] == 1
+    assert sorted(sent["chat_id"] for sent in fake_api.sent) == [1, 2, 3]
+    # El chat que recibió el 429 solo se reintenta después de retry_after.
+    retried = next(sent for sent in fake_api.sent if sent["chat_id"] == 2)
+    assert retried["at"] - started >= 1.0
+    assert sorted(fake_api.acks) == [1, 2, 3]
+
+
+def test_messages_to_one_chat_are_paced(fake_api):
+    async def send_all():
+        sender = broadcast.RateLimitedSender(get_bot(), global_rate=100, per_chat_rate=5)
+        for i in range(4):
+            assert await sender.send(7, f"mensaje {i}")
+
+    asyncio.run(send_all())
+
+    times = [sent["at"] for sent in fake_api.sent if sent["chat_id"] == 7]
+    assert len(times) == 4
+    # 5 mensajes/s por chat: al menos ~0.2 s entre envíos consecutivos.
+    assert all(later - earlier >= 0.18 for earlier, later in zip(times, times[1:]))
+
+
+def test_resumes_from_journal_after_a_crash(fake_api, monkeypatch):
+    fake_api.roster = make_roster([1, 2, 3, 4, 5])
+    monkeypatch.setattr(broadcast, "BROADCAST_PAGE_SIZE", 3)
+    # Caída a mitad de la segunda página: la primera quedó en el checkpoint y el chat 4 en el diario.
+    broadcast.os.makedirs(broadcast.BROADCAST_STATE_DIR)
+    broadcast.save_checkpoint(RUN_DATE, {"date": RUN_DATE.isoformat(), "after_id": 3, "completed": False})
+    with open(broadcast._journal_path(RUN_DATE), "w", encoding="utf-8") as journal:
+        journal.write("1\n2\n3\n4\n")
+
+    result = asyncio.run(broadcast.run_daily_broadcast(RUN_DATE))
+
+    assert [sent["chat_id"] for sent in fake_api.sent] == [5]
+    assert result["completed"]
+    # El envío al chat 4 quedó sin confirmar antes de la caída: se confirma al retomar.
+    assert sorted(fake_api.acks) == [4, 5]
+    assert broadcast.load_journal(RUN_DATE) == {1, 2, 3, 4, 5}
+
+    # Volver a ejecutar un día completado no envía nada.
+    asyncio.run(broadcast.run_daily_broadcast(RUN_DATE))
+    assert len(fake_api.sent) == 1
@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+from app.core import admission, polling
+
+
+async def poll_until_sent(fake_api, expected: int) -> None:
+    stop_event = asyncio.Event()
+    task = asyncio.create_task(polling.run_polling(stop_event))
+    try:
+        for _ in range(200):
+            if len(fake_api.sent) >= expected:
+                break
+            await asyncio.sleep(0.05)
+        stop_event.set()
+        await asyncio.wait_for(task, timeout=5)
+    finally:
+        task.cancel()
+
+
+@pytest.mark.parametrize("admission_enabled", [False, True])
+def test_polling_batches_keeps_chat_order_and_commits_offset_after_the_batch(fake_api, monkeypatch, admission_enabled):
+    monkeypatch.setattr(polling, "POLLING_BATCH_SIZE", 4)
+    monkeypatch.setattr(polling, "POLLING_TIMEOUT", 0)
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", admission_enabled)
+    monkeypatch.setattr(admission, "ADMISSION_COALESCE_WINDOW", 0)
+    monkeypatch.setattr(admission, "admission_controller", admission.AdmissionController())
+    monkeypatch.setattr(polling, "admission_controller", admission.admission_controller)
+    for i in range(3):
+        fake_api.add_message(1, f"uno-{i}")
+        fake_api.add_message(2, f"dos-{i}")
+    fake_api.add_message(3, "tres-0")
+
+    # Con admisión, los mensajes seguidos de un chat dentro del mismo lote se responden en un solo turno.
+    asyncio.run(poll_until_sent(fake_api, 7 if not admission_enabled else 5))
+
+    # Lotes de a lo sumo POLLING_BATCH_SIZE updates (la última llamada solo confirma el offset al detenerse).
+    assert all(call["limit"] == 4 for call in fake_api.get_updates_calls[:-1])
+    assert fake_api.get_updates_calls[-1]["offset"] == 8
+    offsets = [call["offset"] for call in fake_api.get_updates_calls]
+    assert offsets[:3] == [0, 5, 8]
+    # El offset de un lote solo se confirma cuando todos sus mensajes ya se respondieron.
+    first_after_batch = next(call for call in fake_api.get_updates_calls if call["offset"] == 5)
+    assert first_after_batch["sent_before"] >= (4 if not admission_enabled else 2)
+
+    for chat_id, prefix in ((1, "uno"), (2, "dos"), (3, "tres")):
+        answered = "\n".join(fake_api.sent_texts(chat_id)).replace("eco: ", "").split("\n")
+        assert answered == [f"{prefix}-{i}" for i in range(3 if chat_id != 3 else 1)]
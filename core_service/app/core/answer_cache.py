@@ -0,0 +1,153 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+import numpy as np
+from app.core import metrics
+from app.core.state_store import get_state_store
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Días (separados por comas) en los que la caché está desactivada por configuración.
+ANSWER_CACHE_DISABLED_DAYS = {int(day) for day in os.getenv("ANSWER_CACHE_DISABLED_DAYS", "").split(",") if day.strip()}
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "21600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+# Similitud coseno mínima entre los embeddings de dos preguntas para reutilizar la respuesta.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+# Solo se usa la caché si el historial tiene a lo sumo estos turnos (la respuesta casi no depende de él).
+ANSWER_CACHE_MAX_HISTORY_TURNS = int(os.getenv("ANSWER_CACHE_MAX_HISTORY_TURNS", "1"))
+
+def disabled_key(lesson_day: int) -> str:
+    return f"answer_cache:disabled:{lesson_day}"
+
+def history_key(last_answer: str) -> str:
+    """
+    Huella de la última respuesta del asistente: "¿y eso para qué sirve?" depende de ella.
+    """
+    return hashlib.sha1(last_answer.encode("utf-8")).hexdigest() if last_answer else ""
+
+def normalize_question(question: str) -> str:
+    """
+    Normaliza una pregunta para compararla: sin acentos, en minúsculas, sin signos y con espacios simples.
+    """
+    decomposed = unicodedata.normalize("NFKD", question)
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return " ".join(re.findall(r"\w+", folded))
+
+
+class _CacheEntry:
+    def __init__(self, answer: str, vector: Optional[np.ndarray], generation_seconds: float):
+        self.answer = answer
+        self.vector = vector
+        self.generation_seconds = generation_seconds
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """
+    Caché de respuestas de la lección por (día, versión del vectorstore, última respuesta del
+    asistente, pregunta normalizada), con TTL y expulsión LRU. Una pregunta nueva reutiliza una respuesta si su texto normalizado
+    coincide o si el embedding de la pregunta es casi idéntico (ANSWER_CACHE_SIMILARITY).
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[Tuple[int, object, str, str], _CacheEntry]" = OrderedDict()
+
+    async def is_enabled(self, lesson_day: int) -> bool:
+        """
+        Consulta el interruptor del día en el almacén de estado en un hilo, sin bloquear el event loop.
+        """
+        if not ANSWER_CACHE_ENABLED or lesson_day in ANSWER_CACHE_DISABLED_DAYS:
+            return False
+        disabled, _ = await asyncio.to_thread(get_state_store().get, disabled_key(lesson_day))
+        return not disabled
+
+    async def set_enabled(self, lesson_day: int, enabled: bool) -> None:
+        """
+        Interruptor por día, compartido entre workers a través del almacén de estado.
+        """
+        await asyncio.to_thread(_store_enabled, lesson_day, enabled)
+        if not enabled:
+            self.clear(lesson_day)
+
+    def clear(self, lesson_day: Optional[int] = None) -> None:
+        for key in [key for key in self._entries if lesson_day is None or key[0] == lesson_day]:
+            del self._entries[key]
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if now - entry.created_at > ANSWER_CACHE_TTL]:
+            del self._entries[key]
+
+    async def get(self, lesson_day: int, version, last_answer: str, question: str,
+                  embed) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Busca una respuesta para la pregunta. Devuelve (respuesta, None) si hay acierto o
+        (None, embedding de la pregunta) si no, para guardarla luego con `put`. El embedding solo
+        se pide si hay otras entradas con vector con las que compararla; si no, es None.
+        """
+        started = time.perf_counter()
+        self._expire()
+        key = (lesson_day, version, history_key(last_answer), normalize_question(question))
+        entry = self._entries.get(key)
+        vector = None
+        if entry is None:
+            scope = [(other_key, other) for other_key, other in self._entries.items()
+                     if other_key[:3] == key[:3] and other.vector is not None]
+            if scope:
+                try:
+                    vector = _normalize(await asyncio.to_thread(embed, question))
+                    similarities = np.stack([other.vector for _, other in scope]) @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= ANSWER_CACHE_SIMILARITY:
+                        key, entry = scope[best]
+                        metrics.incr("answer_cache_semantic_hits")
+                except Exception as e:
+                    print(f"Error comparando la pregunta con la caché de respuestas: {e}")
+
+        if entry is None:
+            metrics.incr("answer_cache_misses")
+            return None, vector
+
+        self._entries.move_to_end(key)
+        metrics.incr("answer_cache_hits")
+        metrics.incr("answer_cache_saved_seconds", max(entry.generation_seconds - (time.perf_counter() - started), 0.0))
+        return entry.answer, None
+
+    def put(self, lesson_day: int, version, last_answer: str, question: str, answer: str,
+            generation_seconds: float, vector=None) -> None:
+        key = (lesson_day, version, history_key(last_answer), normalize_question(question))
+        vector = _normalize(vector) if vector is not None else None
+        self._entries[key] = _CacheEntry(answer, vector, generation_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > ANSWER_CACHE_MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        counters = metrics.snapshot()["counters"]
+        hits = counters.get("answer_cache_hits", 0)
+        lookups = hits + counters.get("answer_cache_misses", 0)
+        return {
+            "entries": len(self._entries),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "saved_seconds": counters.get("answer_cache_saved_seconds", 0.0),
+        }
+
+
+def _store_enabled(lesson_day: int, enabled: bool) -> None:
+    store = get_state_store()
+    for _ in range(3):
+        _, version = store.get(disabled_key(lesson_day))
+        if store.compare_and_set(disabled_key(lesson_day), None if enabled else {"disabled": True}, version):
+            break
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+answer_cache = AnswerCache()
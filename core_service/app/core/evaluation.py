@@ -1,63 +1,223 @@
+import os
+import json
+import asyncio
+import numpy as np
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from app.models.user_progress import LessonCompletion
-from app.core import logic
+from app.core import logic, metrics
 
 
-DAILY_EVALUATIONS: Dict[int, list] = {
-    1: [
-        {"q": "¿Qué función de Python se usa para mostrar un mensaje en la pantalla?"},
-        {"q": "Imagina que quieres guardar tu nombre en el programa. ¿Qué elemento de Python usarías?"},
-        {"q": "¿Para qué sirve un comentario en el código, como los que empiezan con #?"},
-    ]
-}
+EVALUATION_BANK_FILENAME = "evaluacion.json"
+# Bancos fuente (course_content/evaluaciones). Se usan si el preprocesamiento aún no generó el
+# banco embebido del día: la evaluación sigue disponible y se califica solo con el LLM.
+EVALUATION_SOURCE_PATH = os.getenv("EVALUATION_SOURCE_PATH", "/course_content/evaluaciones")
+
+# Umbrales de similitud coseno contra las respuestas de referencia. Por encima de ACCEPT se aprueba
+# localmente, por debajo de REJECT se rechaza localmente y la franja intermedia se envía al LLM.
+# Son valores por defecto conservadores: calibrate_evaluation.py mide cada pregunta contra un
+# conjunto etiquetado (course_content/evaluaciones/calibracion_dia_N.json) y escribe en el banco
+# los umbrales por pregunta, que tienen prioridad sobre estos.
+ACCEPT_THRESHOLD = float(os.getenv("EVAL_ACCEPT_THRESHOLD", "0.86"))
+REJECT_THRESHOLD = float(os.getenv("EVAL_REJECT_THRESHOLD", "0.62"))
+# En respuestas de hasta estas palabras ("print", "input") la similitud de embeddings no distingue
+# bien entre términos parecidos: solo se aprueban localmente si coinciden con una referencia.
+SHORT_ANSWER_WORDS = 2
+
+_evaluation_banks: Dict[int, tuple[float, dict]] = {}
+
+def load_evaluation_bank(lesson_day: int) -> Optional[dict]:
+    """
+    Carga el banco de preguntas versionado de un día, con sus referencias ya embebidas por preprocess_documents.py.
+    Si no existe, usa el banco fuente sin embeddings. Se cachea en memoria y se recarga si el archivo cambia en disco.
+    """
+    bank_path = os.path.join(logic.VECTORSTORE_BASE_PATH, f"dia_{lesson_day}", EVALUATION_BANK_FILENAME)
+    if not os.path.exists(bank_path):
+        bank_path = os.path.join(EVALUATION_SOURCE_PATH, f"dia_{lesson_day}.json")
+    try:
+        mtime = os.path.getmtime(bank_path)
+    except OSError:
+        return None
+
+    cached = _evaluation_banks.get(lesson_day)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(bank_path, encoding="utf-8") as f:
+            bank = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error leyendo el banco de evaluación del día {lesson_day}: {e}")
+        return None
+
+    # En los bancos fuente (o si falló el embedding al preprocesar) las referencias son solo texto.
+    for question in bank["questions"]:
+        question["references"] = [
+            {"text": ref} if isinstance(ref, str) else ref for ref in question.get("references", [])
+        ]
+
+    vectors, owners = [], []
+    if bank.get("embedding_model") == logic.EMBEDDING_MODEL:
+        for q_index, question in enumerate(bank["questions"]):
+            for ref in question.get("references", []):
+                if ref.get("embedding"):
+                    vectors.append(ref["embedding"])
+                    owners.append(q_index)
+    else:
+        print(f"Advertencia: el banco del día {lesson_day} no tiene embeddings de {logic.EMBEDDING_MODEL}. Se calificará solo con el LLM.")
+
+    bank["ref_matrix"] = _normalize_rows(np.asarray(vectors, dtype=np.float32)) if vectors else None
+    bank["ref_owner"] = np.asarray(owners, dtype=np.int32)
+    _evaluation_banks[lesson_day] = (mtime, bank)
+    print(f"Banco de evaluación del día {lesson_day} (versión {bank.get('version')}) cargado.")
+    return bank
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.clip(norms, 1e-12, None)
+
+def best_reference_similarity(bank: dict, question_indices: List[int], answer_vectors: List[List[float]]) -> np.ndarray:
+    """
+    Similitud coseno de cada respuesta contra la mejor referencia de su propia pregunta.
+    Devuelve NaN para las preguntas sin referencias.
+    """
+    answers = _normalize_rows(np.asarray(answer_vectors, dtype=np.float32))
+    similarities = answers @ bank["ref_matrix"].T
+    owns = bank["ref_owner"][None, :] == np.asarray(question_indices)[:, None]
+    best = np.where(owns, similarities, -np.inf).max(axis=1)
+    return np.where(owns.any(axis=1), best, np.nan)
+
+def _may_accept_locally(answer: str, question: dict) -> bool:
+    answer_tokens = logic.normalize_output_text(answer)
+    if len(answer_tokens) > SHORT_ANSWER_WORDS:
+        return True
+    return any(answer_tokens == logic.normalize_output_text(ref["text"]) for ref in question.get("references", []))
+
+async def grade_answers(bank: dict, answers: List[str]) -> List[bool]:
+    """
+    Califica todas las respuestas de una evaluación por niveles: primero similitud local contra las
+    referencias y solo las respuestas ambiguas se envían al LLM.
+    """
+    questions = bank["questions"]
+    answers = list(answers) + [""] * (len(questions) - len(answers))
+    verdicts: List[Optional[bool]] = [None] * len(questions)
+    tiers = {"local_accept": 0, "local_reject": 0, "llm": 0}
+
+    for i, answer in enumerate(answers):
+        if not answer.strip():
+            verdicts[i] = False
+            tiers["local_reject"] += 1
+
+    pending = [i for i, verdict in enumerate(verdicts) if verdict is None]
+    if bank.get("ref_matrix") is not None and pending:
+        try:
+            embeddings = logic.get_embeddings_local()
+            answer_vectors = await embeddings.aembed_documents([answers[i] for i in pending])
+            similarities = best_reference_similarity(bank, pending, answer_vectors)
+            for i, similarity in zip(pending, similarities):
+                if np.isnan(similarity):
+                    continue
+                accept = questions[i].get("accept_threshold", bank.get("accept_threshold", ACCEPT_THRESHOLD))
+                reject = questions[i].get("reject_threshold", bank.get("reject_threshold", REJECT_THRESHOLD))
+                if similarity >= accept and _may_accept_locally(answers[i], questions[i]):
+                    verdicts[i] = True
+                    tiers["local_accept"] += 1
+                elif similarity <= reject:
+                    verdicts[i] = False
+                    tiers["local_reject"] += 1
+        except Exception as e:
+            print(f"Error en la calificación por similitud, se usará el LLM: {e}")
+
+    ambiguous = [i for i, verdict in enumerate(verdicts) if verdict is None]
+    llm_verdicts = await asyncio.gather(*(
+        logic.grade_quiz_answer(
+            question=questions[i]["q"],
+            user_answer=answers[i],
+            reference_answers=[ref["text"] for ref in questions[i].get("references", [])]
+        )
+        for i in ambiguous
+    ))
+    for i, verdict in zip(ambiguous, llm_verdicts):
+        verdicts[i] = verdict
+    tiers["llm"] = len(ambiguous)
+
+    for tier, count in tiers.items():
+        metrics.incr(f"quiz_grading_{tier}", count)
+    print(f"Calificación del día {bank.get('lesson_day')}: {tiers}")
+    return verdicts
+
+def find_completion(db: Session, telegram_id: int, lesson_day: int) -> Optional[LessonCompletion]:
+    return db.query(LessonCompletion).filter_by(user_telegram_id=telegram_id, lesson_day=lesson_day).first()
+
+def save_completion(db: Session, telegram_id: int, lesson_day: int, score_percent: float) -> float:
+    """
+    Guarda la nota del día de forma idempotente: si ya estaba guardada (un reintento u otro worker),
+    se conserva esa. Devuelve la nota que quedó registrada.
+    """
+    existing_completion = find_completion(db, telegram_id, lesson_day)
+    if existing_completion is None:
+        db.add(LessonCompletion(
+            user_telegram_id=telegram_id,
+            lesson_day=lesson_day,
+            evaluation_score=score_percent
+        ))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            existing_completion = find_completion(db, telegram_id, lesson_day)
+    if existing_completion is not None:
+        return existing_completion.evaluation_score
+    return score_percent
 
 async def start_evaluation_for_day(db: Session, telegram_id: int, lesson_day: int) -> tuple[str, Optional[dict]]:
-    existing_completion = db.query(LessonCompletion).filter_by(user_telegram_id=telegram_id, lesson_day=lesson_day).first()
+    existing_completion = await asyncio.to_thread(find_completion, db, telegram_id, lesson_day)
     if existing_completion:
         return f"¡Felicidades! Ya completaste la evaluación del Día {lesson_day}. Tu puntuación fue: {existing_completion.evaluation_score:.2f}%.", None
 
-    if lesson_day not in DAILY_EVALUATIONS or not DAILY_EVALUATIONS[lesson_day]:
+    bank = load_evaluation_bank(lesson_day)
+    if not bank or not bank.get("questions"):
         return "No hay una evaluación disponible para este día.", None
 
-    first_question = DAILY_EVALUATIONS[lesson_day][0]["q"]
-    eval_state = {"current_q_index": 0, "answers": [], "lesson_day": lesson_day}
-    
+    first_question = bank["questions"][0]["q"]
+    eval_state = {"current_q_index": 0, "answers": [], "lesson_day": lesson_day, "bank_version": bank.get("version")}
+
     return f"¡Es hora de la evaluación para el Día {lesson_day}!\n\n<b>Pregunta 1:</b> {first_question}", eval_state
 
 async def process_evaluation_answer(db: Session, telegram_id: int, user_answer: str, eval_state: dict) -> tuple[str, Optional[dict]]:
     lesson_day = eval_state["lesson_day"]
     current_q_index = eval_state["current_q_index"]
-    questions_for_day = DAILY_EVALUATIONS.get(lesson_day, [])
+    bank = load_evaluation_bank(lesson_day)
+    if not bank or not bank.get("questions"):
+        # Lectura fallida (p. ej. el banco se está regenerando): nunca se califica contra un banco
+        # vacío, porque la nota guardada no se puede repetir. La usuaria vuelve a enviar su respuesta.
+        print(f"No se pudo leer el banco del día {lesson_day} durante la evaluación de {telegram_id}.")
+        return "Tuve un problema leyendo las preguntas de la evaluación. ¿Me envías tu respuesta de nuevo en un momento?", eval_state
+    questions_for_day = bank["questions"]
+
+    # Si el banco cambió a mitad de la evaluación, las respuestas guardadas corresponden a otras
+    # preguntas: se reinicia la evaluación con el banco nuevo.
+    if bank.get("version") != eval_state.get("bank_version"):
+        print(f"El banco del día {lesson_day} cambió durante la evaluación de {telegram_id}; se reinicia.")
+        restart_state = {"current_q_index": 0, "answers": [], "lesson_day": lesson_day, "bank_version": bank.get("version")}
+        return (f"Las preguntas de la evaluación se actualizaron, así que empecemos de nuevo.\n\n"
+                f"<b>Pregunta 1:</b> {questions_for_day[0]['q']}"), restart_state
+
     eval_state["answers"].append(user_answer)
     next_q_index = current_q_index + 1
-    
+
     if next_q_index < len(questions_for_day):
         eval_state["current_q_index"] = next_q_index
         next_question = questions_for_day[next_q_index]["q"]
         return f"¡Recibido! Siguiente pregunta (<b>Pregunta {next_q_index + 1}</b>):\n\n{next_question}", eval_state
-    
+
     else:
-        score = 0
         total_questions = len(questions_for_day)
-        for i, q_data in enumerate(questions_for_day):
-            question_text = q_data["q"]
-            answer_text = eval_state["answers"][i]
-            is_correct = await logic.grade_quiz_answer(
-                question=question_text,
-                user_answer=answer_text
-            )
-            
-            if is_correct:
-                score += 1
-                
-        final_score_percent = (score / total_questions) * 100 if total_questions > 0 else 0
-        completion = LessonCompletion(
-            user_telegram_id=telegram_id,
-            lesson_day=lesson_day,
-            evaluation_score=final_score_percent
-        )
-        db.add(completion)
-        db.commit()
+        verdicts = await grade_answers(bank, eval_state["answers"][:total_questions])
+        score = sum(1 for is_correct in verdicts if is_correct)
+
+        final_score_percent = (score / total_questions) * 100
+        final_score_percent = await asyncio.to_thread(save_completion, db, telegram_id, lesson_day, final_score_percent)
 
-        return f"¡Evaluación del Día {lesson_day} completada! Tu puntuación final es: <b>{final_score_percent:.2f}%</b>. ¡Gran trabajo!", None
\ No newline at end of file
+        return f"¡Evaluación del Día {lesson_day} completada! Tu puntuación final es: <b>{final_score_percent:.2f}%</b>. ¡Gran trabajo!", None
@@ -0,0 +1,23 @@
+import re
+import unicodedata
+from typing import List
+
+# Tokenizador del índice léxico. Lo usan el core_service al consultar y preprocess_documents.py al
+# construir lexical.json; si cambia, hay que cambiar LEXICAL_TOKENIZER y regenerar los índices.
+LEXICAL_TOKENIZER = "fold-v1"
+LEXICAL_STOPWORDS = {
+    "a", "al", "algo", "como", "con", "cual", "cuales", "de", "del", "donde", "el", "ella", "en", "es", "esa",
+    "ese", "eso", "esta", "este", "esto", "hay", "la", "las", "le", "lo", "los", "me", "mi", "muy", "no", "o",
+    "para", "pero", "por", "porque", "que", "se", "si", "sin", "son", "su", "sus", "te", "tu", "un", "una",
+    "uno", "y", "ya", "yo",
+}
+
+def tokenize_for_lexical(text: str) -> List[str]:
+    """
+    Tokeniza para el índice léxico: sin acentos, en minúsculas y sin palabras vacías.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    tokens = [token for token in re.findall(r"\w+", folded) if token not in LEXICAL_STOPWORDS]
+    # Plurales simples: "variables" y "variable" cuentan como el mismo término.
+    return [token[:-1] if len(token) > 3 and token.endswith("s") else token for token in tokens]
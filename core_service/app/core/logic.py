@@ -1,22 +1,35 @@
 import os
+import re
+import time
+import unicodedata
+from difflib import SequenceMatcher
 from datetime import date
-from typing import Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 from sqlalchemy.orm import Session
 from app.models.user_progress import UserProgress, LessonCompletion
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
-from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+from app.core import metrics
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+# Las librerías de LangChain y Google GenAI se importan al primer uso (o durante el warmup)
+# para que el servicio arranque rápido.
 
 load_dotenv()
 
 VECTORSTORE_BASE_PATH = "/vectorstores/"
+EMBEDDING_MODEL = "models/embedding-001"
 
+@lru_cache(maxsize=None)
 def get_llm_local(model_name="gemini-2.0-flash-001", temperature=0.3, max_tokens=350):
     """
     Obtiene una instancia del modelo de lenguaje de Gemini.
+    Las instancias se reutilizan entre peticiones para cada combinación de parámetros.
     """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
     return ChatGoogleGenerativeAI(
         model=model_name,
         google_api_key=os.getenv("GOOGLE_API_KEY"),
@@ -24,11 +37,32 @@ def get_llm_local(model_name="gemini-2.0-flash-001", temperature=0.3, max_tokens
         convert_system_message_to_human=True 
     )
 
+@lru_cache(maxsize=None)
 def get_embeddings_local():
     """
-    Obtiene una instancia de los embeddings de Google.
+    Obtiene una instancia (compartida) de los embeddings de Google, con los embeddings de
+    consultas recientes memorizados.
+    """
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    from app.core.query_embeddings import MemoizedQueryEmbeddings
+
+    return MemoizedQueryEmbeddings(
+        GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=os.getenv("GOOGLE_API_KEY"))
+    )
+
+def compute_lesson_day(start_date: date, today: Optional[date] = None) -> int:
+    """
+    Calcula el día de lección (1 a 30) que le corresponde a una estudiante según su fecha de inicio.
+    """
+    days_since_start = ((today or date.today()) - start_date).days
+    return min(max(1, days_since_start + 1), 30)
+
+def build_day_opener(lesson_day: int) -> str:
+    """
+    Mensaje con el que se abre la lección del día (al primer mensaje o por el envío masivo diario).
     """
-    return GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=os.getenv("GOOGLE_API_KEY"))
+    return (f"¡Hola! ¡Qué bueno verte! 🙌\n\nBienvenida a la <b>Lección del Día {lesson_day}</b>. "
+            f"¿Lista para empezar con la aventura de hoy?")
 
 def get_or_create_user_progress(db: Session, telegram_id: int, user_name: Optional[str] = None) -> tuple[UserProgress, int]:
     """
@@ -45,9 +79,7 @@ def get_or_create_user_progress(db: Session, telegram_id: int, user_name: Option
         if user_name and user.user_name != user_name:
             user.user_name = user_name
         
-        days_since_start = (today - user.start_date).days
-        calculated_lesson_day = max(1, days_since_start + 1)
-        calculated_lesson_day = min(calculated_lesson_day, 30)
+        calculated_lesson_day = compute_lesson_day(user.start_date, today)
     else:
         # Crea el usuario con su nombre
         user = UserProgress(
@@ -89,15 +121,76 @@ async def classify_user_intent(user_input: str) -> str:
         print(f"Error en la clasificación de intención: {e}")
         return "UNKNOWN" # Devolver un estado desconocido en caso de error
 
-async def validate_code_output(user_description: str, expected_output: str) -> bool:
+OUTPUT_TOKEN_SIMILARITY = 0.8
+NEGATION_WORDS = {"no", "nada", "ni", "nunca", "tampoco"}
+ERROR_WORDS = {"error", "traceback", "syntaxerror", "nameerror", "indentationerror", "invalid", "exception", "falla", "fallo"}
+
+def normalize_output_text(text: str) -> List[str]:
+    """
+    Normaliza un texto para compararlo con la salida esperada: sin acentos, sin puntuación y en minúsculas.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    without_accents = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return re.findall(r"\w+", without_accents.casefold())
+
+def _fuzzy_token_in(token: str, candidates: List[str]) -> bool:
+    return any(
+        token == candidate or SequenceMatcher(None, token, candidate).ratio() >= OUTPUT_TOKEN_SIMILARITY
+        for candidate in candidates
+    )
+
+def match_code_output(user_description: str, expected_outputs: List[str]) -> Optional[bool]:
+    """
+    Compara localmente la respuesta de la estudiante con las salidas esperadas.
+    Devuelve True o False cuando el resultado es claro y None cuando hay que consultar al LLM.
+    """
+    user_tokens = normalize_output_text(user_description)
+    if not user_tokens:
+        return None
+
+    user_text = " ".join(user_tokens)
+    mentions_negation = any(token in NEGATION_WORDS for token in user_tokens)
+    mentions_error = any(token in ERROR_WORDS for token in user_tokens)
+
+    best_coverage = 0.0
+    for expected in expected_outputs:
+        expected_tokens = normalize_output_text(expected)
+        if not expected_tokens:
+            continue
+        if f" {' '.join(expected_tokens)} " in f" {user_text} ":
+            coverage = 1.0
+        else:
+            matched = sum(1 for token in expected_tokens if _fuzzy_token_in(token, user_tokens))
+            coverage = matched / len(expected_tokens)
+        best_coverage = max(best_coverage, coverage)
+
+    if best_coverage == 1.0 and not mentions_negation and not mentions_error:
+        return True
+    # Solo se rechaza localmente si la estudiante menciona un error; respuestas como "listo" o
+    # "sí lo vi" no dicen qué salió en pantalla y las decide el LLM.
+    if mentions_error and not mentions_negation and best_coverage < 0.5:
+        return False
+    return None
+
+async def validate_code_output(user_description: str, expected_output: Union[str, List[str]]) -> bool:
     """
-    Usa un LLM para verificar si la descripción del usuario confirma la salida esperada.
+    Verifica si la descripción del usuario confirma la salida esperada.
+    Primero usa el comparador local y solo consulta al LLM cuando la respuesta no es clara.
+    Acepta una o varias salidas válidas para el mismo ejercicio.
     """
+    expected_outputs = [expected_output] if isinstance(expected_output, str) else list(expected_output)
+    local_verdict = match_code_output(user_description, expected_outputs)
+    if local_verdict is not None:
+        metrics.incr("code_output_local_accept" if local_verdict else "code_output_local_reject")
+        return local_verdict
+    metrics.incr("code_output_llm")
+
     validator_llm = get_llm_local(temperature=0, max_tokens=10)
+    expected_text = " o ".join(f'"{expected}"' for expected in expected_outputs)
     
     prompt = f"""
         Tu única tarea es validar si la descripción del estudiante confirma que obtuvo el resultado correcto.
-        El resultado esperado del código es: "{expected_output}"
+        El resultado esperado del código es: {expected_text}
         
         La descripción del estudiante de lo que vio en pantalla es: "{user_description}"
 
@@ -113,16 +206,21 @@ async def validate_code_output(user_description: str, expected_output: str) -> b
         print(f"Error en la validación de la salida: {e}")
         return False
     
-async def grade_quiz_answer(question: str, user_answer: str) -> bool:
+async def grade_quiz_answer(question: str, user_answer: str, reference_answers: Optional[List[str]] = None) -> bool:
     """
     Usa un LLM para calificar si la respuesta de un usuario es conceptualmente correcta.
+    Si hay respuestas de referencia se incluyen en el prompt como guía.
     """
     evaluator_llm = get_llm_local(temperature=0, max_tokens=10)
+    references_block = ""
+    if reference_answers:
+        references_block = "Respuestas correctas de referencia:\n" + "\n".join(f'        - "{ref}"' for ref in reference_answers)
     
     prompt = f"""
         Eres un evaluador experto de quizzes de programación. Tu tarea es calificar la respuesta del estudiante. Enfócate en el concepto, no en las palabras exactas.
         Pregunta del quiz:
         "{question}"
+        {references_block}
         Respuesta del estudiante:
         "{user_answer}"
         ¿Es la respuesta del estudiante conceptualmente correcta para la pregunta?
@@ -136,9 +234,12 @@ async def grade_quiz_answer(question: str, user_answer: str) -> bool:
         print(f"Error en la calificación del quiz: {e}")
         return False
     
-def load_daily_vectorstore(day_number: int) -> Optional[FAISS]:
+_vectorstores: Dict[int, tuple[float, "FAISS"]] = {}
+
+def load_daily_vectorstore(day_number: int) -> Optional["FAISS"]:
     """
     Carga el índice FAISS para un día específico desde el disco.
+    El índice se mantiene en memoria y solo se vuelve a leer si cambia en disco.
     """
     day_store_path = os.path.join(VECTORSTORE_BASE_PATH, f"dia_{day_number}")
     index_file = os.path.join(day_store_path, "index.faiss")
@@ -146,10 +247,18 @@ def load_daily_vectorstore(day_number: int) -> Optional[FAISS]:
     if not os.path.exists(index_file):
         print(f"Error: Vectorstore para el día {day_number} no encontrado en {day_store_path}")
         return None
+
+    mtime = os.path.getmtime(index_file)
+    cached = _vectorstores.get(day_number)
+    if cached and cached[0] == mtime:
+        return cached[1]
     
     try:
+        from langchain_community.vectorstores import FAISS
+
         embeddings = get_embeddings_local()
         vectorstore = FAISS.load_local(day_store_path, embeddings, allow_dangerous_deserialization=True)
+        _vectorstores[day_number] = (mtime, vectorstore)
         print(f"Vectorstore para el día {day_number} cargado correctamente.")
         
         return vectorstore
@@ -159,12 +268,23 @@ def load_daily_vectorstore(day_number: int) -> Optional[FAISS]:
         
         return None
 
-def get_educational_rag_chain(vectorstore: FAISS, lesson_day: int):
+def get_daily_retriever(vectorstore: "FAISS", lesson_day: int):
     """
-    Construye y devuelve una cadena de RAG con una personalidad de profe mejorada.
+    Recuperador del día: híbrido (BM25 + FAISS) si existe el índice léxico, o MMR sobre FAISS si no.
     """
-    llm = get_llm_local(temperature=0.4)
-    retriever = vectorstore.as_retriever(search_type="mmr", search_kwargs={"k": 5, "fetch_k": 20})
+    from app.core.retrieval import HybridRetriever, load_lexical_index
+
+    lexical_index = load_lexical_index(os.path.join(VECTORSTORE_BASE_PATH, f"dia_{lesson_day}"), lesson_day)
+    if lexical_index is None:
+        return vectorstore.as_retriever(search_type="mmr", search_kwargs={"k": 5, "fetch_k": 20})
+    return HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index, k=5, fetch_k=20)
+
+@lru_cache(maxsize=32)
+def get_rag_prompt(lesson_day: int):
+    """
+    Construye (una sola vez por día) el prompt de la profe PySis para la cadena de RAG.
+    """
+    from langchain.prompts import PromptTemplate
 
     personality = (
         "Eres 'PySis', una profesora de programación de Python apasionada y paciente. "
@@ -200,17 +320,70 @@ def get_educational_rag_chain(vectorstore: FAISS, lesson_day: int):
     **Tu respuesta como PySis (en formato HTML):**
     """
     
-    combine_docs_prompt = PromptTemplate(
+    return PromptTemplate(
         template=template_str, input_variables=["context", "chat_history", "question"]
     )
 
-    chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=retriever,
-        combine_docs_chain_kwargs={"prompt": combine_docs_prompt},
-        return_source_documents=False
+async def answer_lesson_question(vectorstore: "FAISS", lesson_day: int, question: str, chat_history: List[tuple]) -> str:
+    """
+    Responde una pregunta de la lección con RAG, como la cadena conversacional de siempre
+    (reformular la pregunta con el historial, recuperar y generar), pero con el prompt ajustado
+    a PROMPT_TOKEN_BUDGET: sin chunks casi duplicados, contexto por relevancia y el historial
+    antiguo resumido, así el tamaño del prompt no crece con la conversación.
+
+    Con poco historial, la respuesta se busca antes en la caché de respuestas del día. La clave
+    incluye la última respuesta del asistente, porque la pregunta puede referirse a ella.
+    """
+    from app.core.answer_cache import answer_cache, ANSWER_CACHE_MAX_HISTORY_TURNS
+
+    if len(chat_history) > ANSWER_CACHE_MAX_HISTORY_TURNS or not await answer_cache.is_enabled(lesson_day):
+        return await _generate_lesson_answer(vectorstore, lesson_day, question, chat_history)
+
+    # La versión del vectorstore (mtime del índice) invalida la caché cuando se regenera el material.
+    version = _vectorstores.get(lesson_day, (None,))[0]
+    last_answer = chat_history[-1][1] if chat_history else ""
+    embeddings = get_embeddings_local()
+    cached_answer, vector = await answer_cache.get(lesson_day, version, last_answer, question, embeddings.embed_query)
+    if cached_answer is not None:
+        return cached_answer
+
+    started = time.perf_counter()
+    answer = await _generate_lesson_answer(vectorstore, lesson_day, question, chat_history)
+    if answer and "LESSON_TOPICS_COVERED" not in answer:
+        if vector is None:
+            # Si la recuperación pasó por FAISS con esta misma pregunta, su embedding ya está calculado;
+            # si tomó el atajo léxico, la entrada se guarda sin vector (solo coincidencias exactas).
+            vector = embeddings.cached_query(question)
+        answer_cache.put(lesson_day, version, last_answer, question, answer, time.perf_counter() - started, vector)
+    return answer
+
+async def _generate_lesson_answer(vectorstore: "FAISS", lesson_day: int, question: str, chat_history: List[tuple]) -> str:
+    from app.core.prompt_budget import (
+        PROMPT_TOKEN_BUDGET, PROMPT_HISTORY_SHARE, build_budgeted_inputs, estimate_tokens, fit_history
+    )
+
+    llm = get_llm_local(temperature=0.4)
+    retriever = get_daily_retriever(vectorstore, lesson_day)
+    rag_prompt = get_rag_prompt(lesson_day)
+
+    standalone_question = question
+    if chat_history:
+        from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+
+        condense_history, _ = fit_history(chat_history, int(PROMPT_TOKEN_BUDGET * PROMPT_HISTORY_SHARE))
+        condensed = await llm.ainvoke(CONDENSE_QUESTION_PROMPT.format(chat_history=condense_history, question=question))
+        standalone_question = condensed.content
+
+    documents = await retriever.ainvoke(standalone_question)
+    template_tokens = estimate_tokens(rag_prompt.format(context="", chat_history="", question=""))
+    context, history = build_budgeted_inputs(
+        template_tokens, standalone_question, [document.page_content for document in documents], chat_history
     )
-    return chain
+    prompt_text = rag_prompt.format(context=context, chat_history=history, question=standalone_question)
+    metrics.observe("rag_prompt_tokens", estimate_tokens(prompt_text))
+
+    response = await llm.ainvoke(prompt_text)
+    return response.content
 
 def check_if_lesson_completed(db: Session, telegram_id: int, lesson_day: int) -> bool:
     """
@@ -0,0 +1,43 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_observations: Dict[str, Dict[str, float]] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    """
+    Incrementa un contador del proceso.
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """
+    Registra una medición (latencia, tamaño, etc.) y mantiene conteo, suma, mínimo, máximo y último valor.
+    """
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            _observations[name] = {"count": 1, "sum": value, "min": value, "max": value, "last": value}
+            return
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+        stats["last"] = value
+
+
+def snapshot() -> dict:
+    """
+    Devuelve una copia de todas las métricas del proceso.
+    """
+    with _lock:
+        observations = {
+            name: {**stats, "avg": stats["sum"] / stats["count"]}
+            for name, stats in _observations.items()
+        }
+        return {"counters": dict(_counters), "observations": observations}
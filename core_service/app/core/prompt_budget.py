@@ -0,0 +1,126 @@
+import os
+import re
+import math
+from typing import List, Tuple
+from app.core import metrics
+
+# Presupuesto total del prompt de generación (estimado localmente, sin llamar a la API).
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Fracción del espacio libre (presupuesto menos instrucciones y pregunta) reservada al historial.
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.35"))
+# Dos chunks con una similitud de Jaccard de shingles igual o mayor se consideran duplicados.
+PROMPT_DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", "0.8"))
+CHARS_PER_TOKEN = 4
+SHINGLE_SIZE = 3
+SUMMARY_QUESTION_CHARS = 80
+# El último turno se conserva con al menos estos tokens aunque el presupuesto del historial sea menor.
+LAST_TURN_MIN_TOKENS = 40
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimación rápida de tokens (~4 caracteres por token para Gemini en español).
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _shingles(text: str) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def drop_near_duplicates(chunks: List[str], threshold: float = PROMPT_DEDUP_THRESHOLD) -> List[str]:
+    """
+    Quita los chunks casi idénticos a uno más relevante (los chunks llegan ordenados por relevancia
+    y se solapan entre sí por el chunk_overlap del preprocesamiento).
+    """
+    kept: List[Tuple[str, set]] = []
+    for chunk in chunks:
+        shingles = _shingles(chunk)
+        if any(len(shingles & other) / len(shingles | other) >= threshold for _, other in kept):
+            metrics.incr("rag_chunks_deduplicated")
+            continue
+        kept.append((chunk, shingles))
+    return [chunk for chunk, _ in kept]
+
+def fit_context(chunks: List[str], budget: int) -> str:
+    """
+    Llena el contexto por orden de relevancia hasta el presupuesto. Un chunk que no cabe se salta
+    (uno menos relevante y más corto todavía puede caber); si no cabe ninguno, se recorta el primero.
+    """
+    selected = []
+    used = 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk) + 1
+        if used + cost <= budget:
+            selected.append(chunk)
+            used += cost
+    if not selected and chunks and budget > 0:
+        selected.append(chunks[0][:budget * CHARS_PER_TOKEN])
+    return "\n\n".join(selected)
+
+def _format_turn(question: str, answer: str) -> str:
+    # Mismo formato que usaba ConversationalRetrievalChain para el historial.
+    return f"\nHuman: {question}\nAssistant: {answer}"
+
+def _truncate_turn(question: str, answer: str, budget: int) -> str:
+    """
+    Recorta un turno al presupuesto: primero la respuesta y, si no alcanza, también la pregunta.
+    """
+    budget_chars = max(budget, 0) * CHARS_PER_TOKEN
+    question = question[:max(budget_chars - len(_format_turn("", "")), 0)]
+    answer_chars = max(budget_chars - len(_format_turn(question, "")) - 3, 0)
+    return _format_turn(question, answer[:answer_chars] + "...")
+
+def fit_history(chat_history: List[Tuple[str, str]], budget: int) -> Tuple[str, int]:
+    """
+    Conserva completos los turnos más recientes que caben en el presupuesto y resume los anteriores
+    en una línea con las preguntas de la estudiante, recortadas, mientras quepan. El último turno
+    siempre se conserva (recortado si no cabe entero): la pregunta nueva suele referirse a él.
+    Devuelve el historial formateado y cuántos turnos se resumieron, recortaron o descartaron.
+    """
+    recent: List[str] = []
+    used = 0
+    index = len(chat_history)
+    truncated = 0
+    if chat_history and estimate_tokens(_format_turn(*chat_history[-1])) > budget:
+        recent.append(_truncate_turn(*chat_history[-1], max(budget, LAST_TURN_MIN_TOKENS)))
+        used = estimate_tokens(recent[0])
+        index -= 1
+        truncated = 1
+    while index > 0:
+        turn = _format_turn(*chat_history[index - 1])
+        cost = estimate_tokens(turn)
+        if used + cost > budget:
+            break
+        recent.insert(0, turn)
+        used += cost
+        index -= 1
+
+    older = chat_history[:index]
+    if not older:
+        return "".join(recent), truncated
+
+    summary = "\n(Temas tratados antes: "
+    summary_budget = budget - used
+    topics = []
+    for question, _ in reversed(older):
+        topic = question.strip()[:SUMMARY_QUESTION_CHARS]
+        if estimate_tokens(summary + "; ".join([topic] + topics) + ")") > summary_budget:
+            break
+        topics.insert(0, topic)
+    history = (summary + "; ".join(topics) + ")" if topics else "") + "".join(recent)
+    return history, len(older) + truncated
+
+def build_budgeted_inputs(template_tokens: int, question: str, chunks: List[str],
+                          chat_history: List[Tuple[str, str]], budget: int = PROMPT_TOKEN_BUDGET) -> Tuple[str, str]:
+    """
+    Reparte el presupuesto del prompt: primero las instrucciones y la pregunta, luego el historial
+    (hasta PROMPT_HISTORY_SHARE del resto) y el contexto con todo lo que quede.
+    Devuelve (contexto, historial) listos para el prompt.
+    """
+    free = max(budget - template_tokens - estimate_tokens(question), 0)
+    history, trimmed_turns = fit_history(chat_history, int(free * PROMPT_HISTORY_SHARE))
+    if trimmed_turns:
+        metrics.incr("rag_history_turns_trimmed", trimmed_turns)
+    context = fit_context(drop_near_duplicates(chunks), free - estimate_tokens(history))
+    return context, history
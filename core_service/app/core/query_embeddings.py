@@ -0,0 +1,45 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+
+QUERY_EMBEDDING_MEMO_SIZE = int(os.getenv("QUERY_EMBEDDING_MEMO_SIZE", "256"))
+
+
+class MemoizedQueryEmbeddings(Embeddings):
+    """
+    Envuelve los embeddings de Google y recuerda los últimos embeddings de consultas, así la
+    caché de respuestas reutiliza el vector que FAISS ya pidió para la misma pregunta (y viceversa)
+    en lugar de hacer otra llamada a la API.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int = QUERY_EMBEDDING_MEMO_SIZE):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self._vectors: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cached_query(text)
+        if vector is not None:
+            return vector
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._vectors[text] = vector
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+        return vector
+
+    def cached_query(self, text: str) -> Optional[List[float]]:
+        """
+        Embedding ya calculado de la consulta, sin llamar a la API; None si no está.
+        """
+        with self._lock:
+            vector = self._vectors.get(text)
+            if vector is not None:
+                self._vectors.move_to_end(text)
+            return vector
@@ -0,0 +1,131 @@
+import os
+import json
+import math
+import time
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from app.core import metrics
+from app.core.lexical_tokenizer import LEXICAL_TOKENIZER, tokenize_for_lexical
+
+LEXICAL_INDEX_FILENAME = "lexical.json"
+# Una consulta se responde solo con el índice léxico si es corta, todas sus palabras aparecen
+# en el mejor chunk y su puntuación BM25 normalizada supera este umbral.
+LEXICAL_CONFIDENCE = float(os.getenv("LEXICAL_CONFIDENCE", "0.45"))
+LEXICAL_MAX_QUERY_TERMS = int(os.getenv("LEXICAL_MAX_QUERY_TERMS", "4"))
+RRF_K = 60
+
+class LexicalIndex:
+    """
+    Índice BM25 de los chunks de un día, generado por preprocess_documents.py.
+    """
+
+    def __init__(self, data: dict):
+        self.chunks: List[str] = data["chunks"]
+        self.doc_lengths: List[int] = data["doc_lengths"]
+        self.postings: Dict[str, List[List[int]]] = data["postings"]
+        self.k1 = data.get("k1", 1.5)
+        self.b = data.get("b", 0.75)
+        self.avgdl = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        n_docs = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, top_n: int) -> tuple[List[tuple[int, float]], float, float]:
+        """
+        Devuelve los `top_n` chunks con su puntuación BM25, la fracción de términos de la consulta
+        presentes en el mejor chunk y la puntuación del mejor normalizada entre 0 y 1.
+        """
+        terms = list(dict.fromkeys(tokenize_for_lexical(query)))
+        scores: Dict[int, float] = {}
+        matched_terms: Dict[int, int] = {}
+        for term in terms:
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / max(self.avgdl, 1e-9))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched_terms[doc_id] = matched_terms.get(doc_id, 0) + 1
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_n]
+        if not ranked or not terms:
+            return ranked, 0.0, 0.0
+
+        best_doc, best_score = ranked[0]
+        coverage = matched_terms[best_doc] / len(terms)
+        max_possible = sum(self.idf.get(term, 0.0) for term in terms) * (self.k1 + 1)
+        return ranked, coverage, (best_score / max_possible if max_possible else 0.0)
+
+
+_lexical_indices: Dict[int, tuple[float, LexicalIndex]] = {}
+
+def load_lexical_index(day_store_path: str, day_number: int) -> Optional[LexicalIndex]:
+    """
+    Carga (y cachea hasta que cambie en disco) el índice léxico de un día, si existe.
+    """
+    index_path = os.path.join(day_store_path, LEXICAL_INDEX_FILENAME)
+    try:
+        mtime = os.path.getmtime(index_path)
+    except OSError:
+        return None
+
+    cached = _lexical_indices.get(day_number)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("tokenizer") != LEXICAL_TOKENIZER:
+            print(f"Advertencia: el índice léxico del día {day_number} usa otro tokenizador; se ignora.")
+            return None
+        index = LexicalIndex(data)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error cargando el índice léxico del día {day_number}: {e}")
+        return None
+
+    _lexical_indices[day_number] = (mtime, index)
+    return index
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Recuperador híbrido: las consultas de palabras clave con una coincidencia léxica clara se
+    responden con BM25 sin llamar a la API de embeddings; el resto combina BM25 y la búsqueda
+    MMR de FAISS con Reciprocal Rank Fusion.
+    """
+
+    vectorstore: Any
+    lexical_index: Any
+    k: int = 5
+    fetch_k: int = 20
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        started = time.perf_counter()
+        lexical_ranked, coverage, confidence = self.lexical_index.search(query, self.fetch_k)
+        n_terms = len(set(tokenize_for_lexical(query)))
+
+        if lexical_ranked and coverage == 1.0 and confidence >= LEXICAL_CONFIDENCE and n_terms <= LEXICAL_MAX_QUERY_TERMS:
+            documents = [Document(page_content=self.lexical_index.chunks[doc_id]) for doc_id, _ in lexical_ranked[:self.k]]
+            metrics.incr("retrieval_lexical_only")
+        else:
+            vector_documents = self.vectorstore.max_marginal_relevance_search(query, k=self.k, fetch_k=self.fetch_k)
+            fused: Dict[str, float] = {}
+            by_content: Dict[str, Document] = {}
+            for rank, document in enumerate(vector_documents):
+                fused[document.page_content] = fused.get(document.page_content, 0.0) + 1 / (RRF_K + rank + 1)
+                by_content[document.page_content] = document
+            for rank, (doc_id, _) in enumerate(lexical_ranked):
+                content = self.lexical_index.chunks[doc_id]
+                fused[content] = fused.get(content, 0.0) + 1 / (RRF_K + rank + 1)
+                by_content.setdefault(content, Document(page_content=content))
+            best = sorted(fused, key=fused.get, reverse=True)[:self.k]
+            documents = [by_content[content] for content in best]
+            metrics.incr("retrieval_hybrid")
+
+        metrics.observe("retrieval_seconds", time.perf_counter() - started)
+        return documents
@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+# "database" guarda el estado en la base de datos del servicio (DATABASE_URL): persiste y sirve para
+# varias réplicas. "sqlite" solo lo comparten los workers de un mismo contenedor y se pierde si el
+# archivo no está en un volumen; "memory" es para un solo worker o desarrollo.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "database")
+# Backends que sobreviven a reinicios y despliegues (sqlite depende de dónde esté el archivo).
+DURABLE_STATE_BACKENDS = {"database", "redis"}
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "./pysis_state.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "pysis:")
+
+
+class StateStore:
+    """
+    Almacén clave-valor versionado para el estado conversacional compartido entre workers.
+
+    Cada clave tiene una versión que crece con cada escritura (0 = nunca escrita). Las escrituras
+    son compare-and-set: solo se aplican si la versión leída sigue siendo la actual, así dos workers
+    que procesan mensajes del mismo usuario no se pisan. Borrar deja una lápida (valor None) con
+    su propia versión para que un lector antiguo tampoco pueda resucitar la clave.
+    """
+
+    def get(self, key: str) -> tuple[Optional[Dict[str, Any]], int]:
+        raise NotImplementedError
+
+    def compare_and_set(self, key: str, value: Optional[Dict[str, Any]], expected_version: int) -> bool:
+        raise NotImplementedError
+
+
+class MemoryStateStore(StateStore):
+    """
+    Implementación en memoria del proceso. Sirve para un solo worker y para desarrollo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, tuple[int, Optional[str]]] = {}
+
+    def get(self, key):
+        with self._lock:
+            version, raw = self._entries.get(key, (0, None))
+        return (json.loads(raw) if raw is not None else None), version
+
+    def compare_and_set(self, key, value, expected_version):
+        raw = json.dumps(value) if value is not None else None
+        with self._lock:
+            current_version, _ = self._entries.get(key, (0, None))
+            if current_version != expected_version:
+                return False
+            self._entries[key] = (current_version + 1, raw)
+            return True
+
+
+class DatabaseStateStore(StateStore):
+    """
+    Implementación sobre la base de datos del servicio (tabla state_entries), compartida por todas
+    las réplicas. El compare-and-set es un UPDATE condicionado a la versión, atómico en Postgres y SQLite.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import Table, Column, MetaData, String, BigInteger, Text
+
+        self._engine = engine
+        metadata = MetaData()
+        self._table = Table(
+            "state_entries", metadata,
+            Column("key", String(255), primary_key=True),
+            Column("version", BigInteger, nullable=False),
+            Column("value", Text, nullable=True),
+        )
+        metadata.create_all(engine)
+
+    def get(self, key):
+        from sqlalchemy import select
+
+        table = self._table
+        with self._engine.connect() as conn:
+            row = conn.execute(select(table.c.version, table.c.value).where(table.c.key == key)).first()
+        if row is None:
+            return None, 0
+        version, raw = row
+        return (json.loads(raw) if raw is not None else None), version
+
+    def compare_and_set(self, key, value, expected_version):
+        from sqlalchemy import insert, update
+        from sqlalchemy.exc import IntegrityError
+
+        table = self._table
+        raw = json.dumps(value) if value is not None else None
+        try:
+            with self._engine.begin() as conn:
+                if expected_version == 0:
+                    conn.execute(insert(table).values(key=key, version=1, value=raw))
+                    return True
+                result = conn.execute(
+                    update(table)
+                    .where(table.c.key == key, table.c.version == expected_version)
+                    .values(version=table.c.version + 1, value=raw)
+                )
+                return result.rowcount == 1
+        except IntegrityError:
+            return False
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Implementación sobre un archivo SQLite compartido por todos los workers de la misma máquina.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state_entries ("
+                "key TEXT PRIMARY KEY, version INTEGER NOT NULL, value TEXT)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT version, value FROM state_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        version, raw = row
+        return (json.loads(raw) if raw is not None else None), version
+
+    def compare_and_set(self, key, value, expected_version):
+        raw = json.dumps(value) if value is not None else None
+        conn = self._connection()
+        if expected_version == 0:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO state_entries (key, version, value) VALUES (?, 1, ?)", (key, raw)
+            )
+        else:
+            cursor = conn.execute(
+                "UPDATE state_entries SET value = ?, version = version + 1 WHERE key = ? AND version = ?",
+                (raw, key, expected_version)
+            )
+        return cursor.rowcount == 1
+
+
+class RedisStateStore(StateStore):
+    """
+    Implementación sobre cualquier servidor que hable el protocolo de Redis (Redis, Valkey, KeyDB...).
+    Usa WATCH/MULTI/EXEC para el compare-and-set, así funciona también con sustitutos locales sin Lua.
+    """
+
+    def __init__(self, url: str, prefix: str = STATE_KEY_PREFIX, client=None):
+        import redis
+
+        self._redis = client if client is not None else redis.Redis.from_url(url, decode_responses=True)
+        self._watch_error = redis.WatchError
+        self.prefix = prefix
+
+    def get(self, key):
+        entry = self._redis.hgetall(self.prefix + key)
+        if not entry:
+            return None, 0
+        raw = entry.get("value", "")
+        return (json.loads(raw) if raw else None), int(entry["version"])
+
+    def compare_and_set(self, key, value, expected_version):
+        redis_key = self.prefix + key
+        raw = json.dumps(value) if value is not None else ""
+        with self._redis.pipeline() as pipe:
+            try:
+                pipe.watch(redis_key)
+                current_version = int(pipe.hget(redis_key, "version") or 0)
+                if current_version != expected_version:
+                    return False
+                pipe.multi()
+                pipe.hset(redis_key, mapping={"version": current_version + 1, "value": raw})
+                pipe.execute()
+                return True
+            except self._watch_error:
+                return False
+
+
+@lru_cache(maxsize=None)
+def get_state_store() -> StateStore:
+    """
+    Devuelve el almacén de estado configurado con STATE_BACKEND (database, memory, sqlite o redis).
+    """
+    if STATE_BACKEND == "database":
+        from app.core.database import engine
+
+        return DatabaseStateStore(engine)
+    if STATE_BACKEND == "memory":
+        return MemoryStateStore()
+    if STATE_BACKEND == "sqlite":
+        return SQLiteStateStore(STATE_SQLITE_PATH)
+    if STATE_BACKEND == "redis":
+        return RedisStateStore(REDIS_URL)
+    raise ValueError(f"STATE_BACKEND desconocido: {STATE_BACKEND}")
+
+def try_acquire_lease(store: StateStore, key: str, ttl: float) -> Optional[str]:
+    """
+    Intenta tomar un lease exclusivo sobre `key` durante `ttl` segundos.
+    Devuelve el identificador del dueño si lo obtuvo, o None si otro lo tiene vigente.
+    """
+    lease, version = store.get(key)
+    if lease and lease.get("expires_at", 0) > time.time():
+        return None
+    owner = uuid.uuid4().hex
+    if store.compare_and_set(key, {"owner": owner, "expires_at": time.time() + ttl}, version):
+        return owner
+    return None
+
+def release_lease(store: StateStore, key: str, owner: str) -> None:
+    """
+    Libera el lease si sigue siendo de `owner` (si venció y lo tomó otro, no se toca).
+    """
+    lease, version = store.get(key)
+    if lease and lease.get("owner") == owner:
+        store.compare_and_set(key, None, version)
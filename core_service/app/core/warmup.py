@@ -0,0 +1,77 @@
+import os
+import time
+import asyncio
+from datetime import date, timedelta
+from typing import List
+from sqlalchemy import func
+from app.core.database import SessionLocal
+from app.core import logic, evaluation
+from app.models.user_progress import UserProgress
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_MAX_DAYS = int(os.getenv("WARMUP_MAX_DAYS", "5"))
+WARMUP_ACTIVE_WINDOW_DAYS = int(os.getenv("WARMUP_ACTIVE_WINDOW_DAYS", "7"))
+
+warmup_status = {"ready": False, "started_at": None, "finished_at": None, "lesson_days": [], "error": None}
+
+def likely_lesson_days() -> List[int]:
+    """
+    Calcula los días de lección que más probablemente se usarán hoy, a partir de la fecha de inicio
+    de las estudiantes activas recientemente. El Día 1 siempre se incluye para las nuevas.
+    """
+    today = date.today()
+    db = SessionLocal()
+    try:
+        rows = db.query(UserProgress.start_date, func.count(UserProgress.user_telegram_id)).filter(
+            UserProgress.last_accessed_date >= today - timedelta(days=WARMUP_ACTIVE_WINDOW_DAYS)
+        ).group_by(UserProgress.start_date).all()
+    finally:
+        db.close()
+
+    students_per_day = {1: 0}
+    for start_date, count in rows:
+        lesson_day = logic.compute_lesson_day(start_date, today)
+        students_per_day[lesson_day] = students_per_day.get(lesson_day, 0) + count
+
+    ranked = sorted(students_per_day, key=lambda day: students_per_day[day], reverse=True)
+    return ranked[:max(1, WARMUP_MAX_DAYS)]
+
+def run_warmup() -> None:
+    """
+    Importa las librerías pesadas, crea los clientes de Gemini y precarga los índices,
+    bancos de evaluación y prompts de los días más probables.
+    """
+    started = time.perf_counter()
+    logic.get_llm_local()
+    logic.get_llm_local(temperature=0, max_tokens=10)
+    logic.get_llm_local(temperature=0.4)
+    logic.get_embeddings_local()
+    print(f"Warmup: clientes de Gemini listos en {time.perf_counter() - started:.2f}s")
+
+    lesson_days = likely_lesson_days()
+    warmup_status["lesson_days"] = lesson_days
+    for lesson_day in lesson_days:
+        day_started = time.perf_counter()
+        vectorstore = logic.load_daily_vectorstore(lesson_day)
+        if vectorstore is not None:
+            logic.get_daily_retriever(vectorstore, lesson_day)
+        evaluation.load_evaluation_bank(lesson_day)
+        logic.get_rag_prompt(lesson_day)
+        print(f"Warmup: Día {lesson_day} precargado en {time.perf_counter() - day_started:.2f}s")
+
+async def start_warmup() -> None:
+    """
+    Ejecuta el warmup en segundo plano sin bloquear el event loop y marca el servicio como listo al terminar.
+    """
+    warmup_status["started_at"] = time.time()
+    if WARMUP_ENABLED:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(run_warmup)
+            print(f"Warmup completado en {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            # Un warmup fallido no debe dejar el servicio fuera de rotación: las cargas se harán bajo demanda.
+            warmup_status["error"] = str(e)
+            print(f"Error durante el warmup: {e}")
+    warmup_status["finished_at"] = time.time()
+    warmup_status["ready"] = True
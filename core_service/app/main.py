@@ -1,20 +1,76 @@
-from fastapi import FastAPI
-from app.core.database import init_db
+import time
+_process_started = time.perf_counter()
+
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from app.core.database import init_db, SessionLocal
+from app.core import metrics, warmup
+from app.core.answer_cache import answer_cache
 from app.routes import conversation
 
+print(f"Core Service: módulos importados en {time.perf_counter() - _process_started:.2f}s")
+
 app = FastAPI(
     title="Core PySis RAG Service",
     description="Maneja la lógica del curso, progreso de usuarios y RAG diario."
 )
 
+_background_tasks = set()
+_first_answer_served = False
+# Rutas que responden en streaming (NDJSON).
+STREAMING_PATHS = {"/conversation/query-batch"}
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     print("Iniciando Core Service (RAG Service)...")
     init_db()
-    print("Core Service iniciado y base de datos lista.")
+    db = SessionLocal()
+    try:
+        migrated = conversation.migrate_legacy_sessions(db)
+        if migrated:
+            print(f"{migrated} sesiones de user_sessions migradas al almacén de estado.")
+    finally:
+        db.close()
+    task = asyncio.create_task(warmup.start_warmup())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    print("Core Service iniciado y base de datos lista. Warmup en segundo plano.")
+
+@app.middleware("http")
+async def measure_conversation_latency(request: Request, call_next):
+    if not request.url.path.startswith("/conversation"):
+        return await call_next(request)
+    started = time.perf_counter()
+    response = await call_next(request)
+    finished = time.perf_counter()
+    # Las respuestas en streaming siguen enviándose después de call_next: aquí solo se mide hasta las cabeceras.
+    metric = "time_to_headers_seconds" if request.url.path in STREAMING_PATHS else "latency_seconds"
+    metrics.observe(f"{metric}:{request.url.path}", finished - started)
+    # Latencia del primer mensaje respondido: es la que paga el arranque en frío si el warmup no terminó.
+    global _first_answer_served
+    if not _first_answer_served and request.url.path == "/conversation/query" and response.status_code == 200:
+        _first_answer_served = True
+        metrics.observe("time_to_first_answer_seconds", finished - started)
+    return response
 
 app.include_router(conversation.router, prefix="/conversation", tags=["Conversation"])
 
 @app.get("/", tags=["Health Check"])
 def read_root():
-    return {"status": "Core Service (RAG Service) está funcionando"}
\ No newline at end of file
+    return {"status": "Core Service (RAG Service) está funcionando"}
+
+@app.get("/ready", tags=["Health Check"])
+def read_ready():
+    """
+    Indica si el warmup terminó y el servicio puede recibir tráfico sin pagar el arranque en frío.
+    """
+    status_code = 200 if warmup.warmup_status["ready"] else 503
+    return JSONResponse(status_code=status_code, content=warmup.warmup_status)
+
+@app.get("/metrics", tags=["Health Check"])
+def read_metrics():
+    """
+    Métricas internas del proceso (niveles de calificación, latencias, etc.).
+    """
+    return {**metrics.snapshot(), "answer_cache": answer_cache.stats()}
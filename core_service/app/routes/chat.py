@@ -2,12 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.schemas import QueryInput, ConversationResponse, ChatHistoryEntry
 from app.core.database import get_db
+from app.core.state_store import get_state_store
 from app.core import logic, evaluation
-from typing import Dict
 
 router = APIRouter()
 
-active_evaluations_state: Dict[str, Dict] = {}
+def evaluation_key(telegram_id_str: str) -> str:
+    return f"evaluation:{telegram_id_str}"
 
 @router.post("/query", response_model=ConversationResponse)
 async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
@@ -19,8 +20,10 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
     telegram_id_int = int(telegram_id_str)
     user_question = query.question.lower().strip()
 
-    if telegram_id_str in active_evaluations_state:
-        eval_state = active_evaluations_state[telegram_id_str]
+    store = get_state_store()
+    eval_state, eval_version = store.get(evaluation_key(telegram_id_str))
+
+    if eval_state:
         response_text, new_eval_state = await evaluation.process_evaluation_answer(
             db=db,
             telegram_id=telegram_id_int,
@@ -28,11 +31,9 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
             eval_state=eval_state
         )
         
-        if new_eval_state:
-            active_evaluations_state[telegram_id_str] = new_eval_state
-        else:
-            del active_evaluations_state[telegram_id_str]
-            
+        if not store.compare_and_set(evaluation_key(telegram_id_str), new_eval_state, eval_version):
+            raise HTTPException(status_code=409, detail="La evaluación cambió mientras se procesaba la respuesta.")
+
         return ConversationResponse(
             conversation_id=telegram_id_str,
             answer=response_text,
@@ -44,9 +45,9 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
     if user_question in ["evaluacion", "evaluación", "examen", "prueba"]:
         response_text, eval_state = await evaluation.start_evaluation_for_day(db, telegram_id_int, lesson_day)
         
-        if eval_state:
-            active_evaluations_state[telegram_id_str] = eval_state
-            
+        if eval_state and not store.compare_and_set(evaluation_key(telegram_id_str), eval_state, eval_version):
+            raise HTTPException(status_code=409, detail="La evaluación cambió mientras se iniciaba.")
+
         return ConversationResponse(
             conversation_id=telegram_id_str,
             answer=response_text,
@@ -57,16 +58,9 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
     if not vectorstore:
         raise HTTPException(status_code=500, detail=f"No se pudo cargar el material de estudio para el Día {lesson_day}.")
     
-    rag_chain = logic.get_educational_rag_chain(vectorstore, lesson_day)
-    
-    chat_history = [] 
-    
     try:
-        result = rag_chain.invoke({
-            "question": query.question,
-            "chat_history": chat_history 
-        })
-        answer = result.get("answer", "No he podido encontrar una respuesta.")
+        answer = await logic.answer_lesson_question(vectorstore, lesson_day, query.question, [])
+        answer = answer or "No he podido encontrar una respuesta."
     except Exception as e:
         print(f"Error durante la invocación de la cadena RAG: {e}")
         raise HTTPException(status_code=500, detail="Ocurrió un error al procesar tu pregunta.")
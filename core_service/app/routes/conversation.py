@@ -1,61 +1,257 @@
+import os
+import json
+import time
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
-from app.schemas import QueryInput, ConversationResponse
-from app.core.database import get_db
-from app.models.user_progress import UserSession
-from app.core import logic, evaluation
-from typing import Dict, Any
-from datetime import date
+from app.schemas import QueryInput, QueryBatchInput, ConversationResponse, RosterEntry, BroadcastAck
+from app.core.database import get_db, SessionLocal
+from app.core.state_store import (
+    STATE_BACKEND, DURABLE_STATE_BACKENDS, get_state_store, try_acquire_lease, release_lease
+)
+from app.models.user_progress import UserProgress, UserSession
+from app.core import logic, evaluation, metrics
+from app.core.answer_cache import answer_cache
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+from datetime import date, timedelta
 
 router = APIRouter()
 
-def get_or_create_session(db: Session, telegram_id_int: int) -> Dict[str, Any]:
-    """Obtiene la sesión desde la BD o crea una nueva."""
-    db_session = db.query(UserSession).filter(UserSession.user_telegram_id == telegram_id_int).first()
-    if db_session:
-        return db_session.session_data
-    else:
-        default_session_data = {"state": "START_DAY", "chat_history": [], "expected_output": None}
-        new_db_session = UserSession(user_telegram_id=telegram_id_int, session_data=default_session_data)
-        db.add(new_db_session)
-        db.commit()
-        db.refresh(new_db_session)
-        return default_session_data
-
-def save_session(db: Session, telegram_id_int: int, session_data: Dict[str, Any]):
-    """Guarda la sesión actualizada en la BD."""
-    db_session = db.query(UserSession).filter(UserSession.user_telegram_id == telegram_id_int).first()
-    if db_session:
-        db_session.session_data = session_data
-        flag_modified(db_session, "session_data")
-        db.commit()
+SESSION_WRITE_ATTEMPTS = int(os.getenv("SESSION_WRITE_ATTEMPTS", "3"))
+# Lease por usuaria: sus turnos se procesan de a uno aunque lleguen a workers distintos.
+SESSION_LEASE_TTL = float(os.getenv("SESSION_LEASE_TTL", "90"))
+SESSION_LEASE_WAIT = float(os.getenv("SESSION_LEASE_WAIT", "30"))
+BUSY_ANSWER = "Recibí varios mensajes tuyos al mismo tiempo. ¿Me repites el último, por favor?"
+BROADCAST_ACTIVE_WINDOW_DAYS = int(os.getenv("BROADCAST_ACTIVE_WINDOW_DAYS", "7"))
+# Usuarias distintas que se procesan a la vez en /query-batch y tamaño máximo de un lote.
+BATCH_USER_CONCURRENCY = int(os.getenv("BATCH_USER_CONCURRENCY", "8"))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "5000"))
+
+def new_session() -> Dict[str, Any]:
+    return {"state": "START_DAY", "chat_history": [], "expected_output": None}
+
+def session_key(telegram_id_int: int) -> str:
+    return f"session:{telegram_id_int}"
+
+def lease_key(telegram_id_int: int) -> str:
+    return f"lease:session:{telegram_id_int}"
+
+def load_session(telegram_id_int: int) -> tuple[Dict[str, Any], int]:
+    """
+    Obtiene la sesión y su versión desde el almacén de estado compartido, o crea una nueva.
+    """
+    session, version = get_state_store().get(session_key(telegram_id_int))
+    if session is None:
+        session = new_session()
+
+    if "chat_history" in session and isinstance(session["chat_history"], list):
+        session["chat_history"] = [tuple(item) for item in session["chat_history"]]
+    return session, version
+
+def save_session(telegram_id_int: int, session_data: Dict[str, Any], version: int) -> bool:
+    """
+    Guarda la sesión solo si nadie más la modificó desde que se leyó (compare-and-set).
+    """
+    return get_state_store().compare_and_set(session_key(telegram_id_int), session_data, version)
+
+def migrate_legacy_sessions(db: Session) -> int:
+    """
+    Migración única: copia al almacén de estado las sesiones de la tabla user_sessions que aún no
+    estén en él y borra esas filas, para que nunca se vuelva a leer una sesión antigua.
+    Solo se hace con un backend durable: con memory (o sqlite en un disco efímero) las sesiones
+    se perderían en el siguiente reinicio, así que la tabla se deja intacta.
+    """
+    if STATE_BACKEND not in DURABLE_STATE_BACKENDS:
+        if db.query(UserSession).first() is not None:
+            print(f"Advertencia: STATE_BACKEND={STATE_BACKEND} no es durable; las sesiones de user_sessions "
+                  f"no se migran ni se borran (usa database o redis para migrarlas).")
+        return 0
+
+    store = get_state_store()
+    migrated = 0
+    for row in db.query(UserSession).all():
+        key = session_key(row.user_telegram_id)
+        _, version = store.get(key)
+        if version == 0 and store.compare_and_set(key, dict(row.session_data), 0):
+            migrated += 1
+        db.delete(row)
+    db.commit()
+    return migrated
+
+async def acquire_turn_lease(telegram_id_int: int) -> Optional[str]:
+    """
+    Espera hasta SESSION_LEASE_WAIT segundos a que la usuaria no tenga otro turno en curso.
+    """
+    deadline = time.monotonic() + SESSION_LEASE_WAIT
+    while True:
+        owner = await asyncio.to_thread(try_acquire_lease, get_state_store(), lease_key(telegram_id_int), SESSION_LEASE_TTL)
+        if owner or time.monotonic() >= deadline:
+            return owner
+        await asyncio.sleep(0.1)
 
 @router.post("/query", response_model=ConversationResponse)
 async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
-    telegram_id_str = query.phone_number
-    telegram_id_int = int(telegram_id_str)
-    user_question = query.question
-    user_name = query.user_name
-    user_progress, lesson_day = logic.get_or_create_user_progress(
-        db, telegram_id_int, user_name=user_name
+    user_progress, lesson_day = await asyncio.to_thread(
+        logic.get_or_create_user_progress, db, int(query.phone_number), user_name=query.user_name
     )
-    session = get_or_create_session(db, telegram_id_int)
-    
-    if "chat_history" in session and isinstance(session["chat_history"], list):
-        session["chat_history"] = [tuple(item) for item in session["chat_history"]]
+    return await answer_query(db, query, user_progress, lesson_day)
+
+async def answer_query(db: Session, query: QueryInput, user_progress: UserProgress, lesson_day: int) -> ConversationResponse:
+    """
+    Procesa un mensaje de una usuaria cuyo progreso ya se cargó y guarda su sesión.
+    Las llamadas bloqueantes a la base de datos y al almacén de estado corren en hilos aparte,
+    para no detener el event loop mientras se atienden otras usuarias (p. ej. en /query-batch).
+    """
+    telegram_id_str = query.phone_number
+    telegram_id_int = user_progress.user_telegram_id
+    is_new_day = user_progress.last_accessed_date != date.today()
+
+    # El turno tiene efectos (llamadas al LLM, la nota de la evaluación): con el lease, dos mensajes
+    # de la misma usuaria nunca se procesan a la vez y el turno no se repite por un conflicto.
+    owner = await acquire_turn_lease(telegram_id_int)
+    if owner is None:
+        metrics.incr("session_lease_timeouts")
+        return ConversationResponse(conversation_id=telegram_id_str, answer=BUSY_ANSWER)
+
+    try:
+        # El compare-and-set queda como red de seguridad por si el lease venció a mitad del turno
+        # (turno más largo que SESSION_LEASE_TTL); la nota de la evaluación se guarda de forma idempotente.
+        for attempt in range(SESSION_WRITE_ATTEMPTS):
+            session, version = await asyncio.to_thread(load_session, telegram_id_int)
+            # Si hoy ya se le envió la apertura de la lección (envío masivo), la sesión ya es la del día.
+            if is_new_day and attempt == 0 and session.get("opener_sent_on") != date.today().isoformat():
+                session = new_session()
 
-    if user_progress.last_accessed_date != date.today():
-        session = {"state": "START_DAY", "chat_history": [], "expected_output": None}
-        user_progress.last_accessed_date = date.today()
-        db.commit()
+            answer = await run_conversation_turn(db, telegram_id_int, query.question, lesson_day, session)
 
+            if await asyncio.to_thread(save_session, telegram_id_int, session, version):
+                if is_new_day:
+                    user_progress.last_accessed_date = date.today()
+                    await asyncio.to_thread(db.commit)
+                return ConversationResponse(
+                    conversation_id=telegram_id_str, answer=answer
+                )
+            metrics.incr("session_write_conflicts")
+            print(f"Conflicto guardando la sesión de {telegram_id_int} (intento {attempt + 1}), reintentando.")
+    finally:
+        await asyncio.to_thread(release_lease, get_state_store(), lease_key(telegram_id_int), owner)
+
+    return ConversationResponse(conversation_id=telegram_id_str, answer=BUSY_ANSWER)
+
+@router.post("/query-batch")
+async def handle_query_batch(batch: QueryBatchInput):
+    """
+    Procesa muchos mensajes de una vez (envíos masivos, reprocesos, pruebas de carga).
+    Los mensajes de una misma usuaria se procesan en orden y con una sola sesión de base de datos;
+    usuarias distintas se procesan en paralelo (hasta BATCH_USER_CONCURRENCY).
+    Responde en NDJSON: una línea por mensaje, con su `index` en el lote, en cuanto termina.
+    """
+    if len(batch.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {BATCH_MAX_QUERIES} mensajes.")
+
+    groups: Dict[str, List[tuple[int, QueryInput]]] = {}
+    for index, query in enumerate(batch.queries):
+        groups.setdefault(query.phone_number, []).append((index, query))
+
+    await asyncio.to_thread(prefetch_batch_resources, list(groups))
+    results: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(BATCH_USER_CONCURRENCY)
+
+    async def run_group(items: List[tuple[int, QueryInput]]):
+        published = set()
+
+        async def publish(result: dict) -> None:
+            published.add(result["index"])
+            await results.put(result)
+
+        try:
+            async with semaphore:
+                await process_user_group(items, publish)
+        except Exception as e:
+            # El stream espera una línea por mensaje: los que quedaron sin publicar se reportan como error.
+            print(f"Error procesando el grupo de {items[0][1].phone_number} en el lote: {e}")
+            metrics.incr("batch_query_errors")
+            for index, query in items:
+                if index not in published:
+                    await results.put({"index": index, "conversation_id": query.phone_number, "error": str(e)})
+
+    async def stream_results():
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(run_group(items)) for items in groups.values()]
+        try:
+            for _ in range(len(batch.queries)):
+                yield json.dumps(await results.get(), ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            # El middleware solo ve el tiempo hasta las cabeceras; esta es la duración del lote completo.
+            metrics.observe("batch_stream_seconds", time.perf_counter() - started)
+
+    metrics.incr("batch_queries_received", len(batch.queries))
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def prefetch_batch_resources(telegram_ids: List[str]) -> None:
+    """
+    Precarga una sola vez, para todo el lote, los índices y bancos de evaluación de los días
+    de lección de las usuarias del lote.
+    """
+    ids = [int(telegram_id) for telegram_id in telegram_ids if telegram_id.isdigit()]
+    db = SessionLocal()
+    try:
+        rows = db.query(UserProgress.start_date).filter(UserProgress.user_telegram_id.in_(ids)).distinct().all()
+    finally:
+        db.close()
+    lesson_days = {logic.compute_lesson_day(start_date) for (start_date,) in rows}
+    if len(rows) < len(ids):
+        # Las usuarias nuevas empiezan en el día 1.
+        lesson_days.add(1)
+    for lesson_day in sorted(lesson_days):
+        logic.load_daily_vectorstore(lesson_day)
+        evaluation.load_evaluation_bank(lesson_day)
+
+async def process_user_group(items: List[tuple[int, QueryInput]], publish: Callable[[dict], Awaitable[None]]) -> None:
+    """
+    Procesa en orden los mensajes de una usuaria con una sola sesión de base de datos y
+    publica cada resultado con `publish`. Un mensaje fallido no detiene los siguientes.
+    """
+    db = SessionLocal()
+    try:
+        try:
+            first_query = items[0][1]
+            user_name = next((query.user_name for _, query in reversed(items) if query.user_name), None)
+            user_progress, lesson_day = await asyncio.to_thread(
+                logic.get_or_create_user_progress, db, int(first_query.phone_number), user_name=user_name
+            )
+        except Exception as e:
+            print(f"Error cargando el progreso de {items[0][1].phone_number} en el lote: {e}")
+            await asyncio.to_thread(db.rollback)
+            for index, query in items:
+                await publish({"index": index, "conversation_id": query.phone_number, "error": str(e)})
+            return
+
+        for index, query in items:
+            try:
+                response = await answer_query(db, query, user_progress, lesson_day)
+                await publish({"index": index, **response.dict()})
+            except Exception as e:
+                print(f"Error procesando el mensaje {index} del lote ({query.phone_number}): {e}")
+                await asyncio.to_thread(db.rollback)
+                metrics.incr("batch_query_errors")
+                await publish({"index": index, "conversation_id": query.phone_number, "error": str(e)})
+    finally:
+        await asyncio.to_thread(db.close)
+
+async def run_conversation_turn(db: Session, telegram_id_int: int, user_question: str, lesson_day: int, session: Dict[str, Any]) -> str:
+    """
+    Avanza la máquina de estados de la lección con un mensaje de la usuaria.
+    Modifica la sesión recibida y devuelve la respuesta para la usuaria.
+    """
     current_state = session.get("state", "START_DAY")
     answer = "Lo siento, algo no salió como esperaba. ¿Podemos intentar de nuevo?"
 
     if current_state == "START_DAY":
-        answer = (f"¡Hola! ¡Qué bueno verte! 🙌\n\nBienvenida a la <b>Lección del Día {lesson_day}</b>. "
-                  f"¿Lista para empezar con la aventura de hoy?")
+        answer = logic.build_day_opener(lesson_day)
         session["state"] = "AWAITING_START_CONFIRMATION"
 
     elif current_state == "AWAITING_START_CONFIRMATION":
@@ -77,7 +273,7 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
                       "<code>print(\"¡Hola, Mundo!\")</code>\n\n"
                       "Dime qué resultado te apareció en la pantalla.")
             session["state"] = "AWAITING_CODE_OUTPUT"
-            session["expected_output"] = "¡Hola, Mundo!"
+            session["expected_output"] = ["¡Hola, Mundo!"]
         else:
             answer = "No hay prisa. Avísame cuando estés lista para continuar."
 
@@ -88,7 +284,9 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
                       "Ahora que rompiste el hielo, ¿lista para aprender sobre las <b>variables</b>?")
             session["state"] = "PROMPT_FOR_VARIABLES"
         else:
-            answer = (f"Mmm, no es correcto. El resultado debería ser <code>{session['expected_output']}</code>.\n\n"
+            expected_output = session["expected_output"]
+            shown_output = expected_output if isinstance(expected_output, str) else expected_output[0]
+            answer = (f"Mmm, no es correcto. El resultado debería ser <code>{shown_output}</code>.\n\n"
                       "Revisa bien el código, ¡y dime qué obtienes!")
 
     elif current_state == "PROMPT_FOR_VARIABLES":
@@ -97,9 +295,7 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
             session["state"] = "LESSON_Q&A"
             teacher_prompt = "INICIAR_TEMA_VARIABLES"
             vectorstore = logic.load_daily_vectorstore(lesson_day)
-            rag_chain = logic.get_educational_rag_chain(vectorstore, lesson_day)
-            result = await rag_chain.ainvoke({"question": teacher_prompt, "chat_history": session["chat_history"]})
-            answer = result.get("answer")
+            answer = await logic.answer_lesson_question(vectorstore, lesson_day, teacher_prompt, session["chat_history"])
             session["chat_history"].append((user_question, answer))
         else:
             answer = "Ok, tómate tu tiempo. Avísame cuando estés lista."
@@ -113,9 +309,7 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
             answer = response_text
         else:
             vectorstore = logic.load_daily_vectorstore(lesson_day)
-            rag_chain = logic.get_educational_rag_chain(vectorstore, lesson_day)
-            result = await rag_chain.ainvoke({"question": user_question, "chat_history": session["chat_history"]})
-            rag_answer = result.get("answer", "")
+            rag_answer = await logic.answer_lesson_question(vectorstore, lesson_day, user_question, session["chat_history"])
             
             if "LESSON_TOPICS_COVERED" in rag_answer:
                 session["state"] = "PROMPT_FOR_EVALUATION"
@@ -150,7 +344,68 @@ async def handle_chat_query(query: QueryInput, db: Session = Depends(get_db)):
     elif current_state == "DAY_COMPLETE":
         answer = "¡Lección del día completada! 💪 Si tienes más dudas sobre este tema, puedes seguir preguntando. Si no, ¡nos vemos mañana para la siguiente lección! 🚀"
 
-    save_session(db, telegram_id_int, session)
-    return ConversationResponse(
-        conversation_id=telegram_id_str, answer=answer
-    )
\ No newline at end of file
+    return answer
+
+@router.get("/broadcast-roster", response_model=List[RosterEntry])
+def get_broadcast_roster(after_id: int = 0, limit: int = 500, db: Session = Depends(get_db)):
+    """
+    Página (ordenada por telegram_id) de estudiantes activas que aún no abrieron la lección de hoy,
+    con el mensaje de apertura que les corresponde. La usa el envío masivo diario del channel_service.
+    """
+    today = date.today()
+    students = db.query(UserProgress).filter(
+        UserProgress.user_telegram_id > after_id,
+        UserProgress.start_date > today - timedelta(days=30),
+        UserProgress.last_accessed_date >= today - timedelta(days=BROADCAST_ACTIVE_WINDOW_DAYS),
+        UserProgress.last_accessed_date < today
+    ).order_by(UserProgress.user_telegram_id).limit(min(limit, 5000)).all()
+
+    roster = []
+    for student in students:
+        lesson_day = logic.compute_lesson_day(student.start_date, today)
+        roster.append(RosterEntry(
+            telegram_id=student.user_telegram_id,
+            user_name=student.user_name,
+            lesson_day=lesson_day,
+            text=logic.build_day_opener(lesson_day)
+        ))
+    return roster
+
+@router.post("/broadcast-ack")
+def acknowledge_broadcast(ack: BroadcastAck, db: Session = Depends(get_db)):
+    """
+    Marca que a estas estudiantes ya se les envió la apertura de hoy, para que su próxima respuesta
+    continúe la lección en lugar de repetir el saludo.
+    """
+    today = date.today().isoformat()
+    # Quien ya escribió hoy tiene la lección en curso: no se toca su sesión.
+    started_today = {
+        telegram_id for (telegram_id,) in db.query(UserProgress.user_telegram_id).filter(
+            UserProgress.user_telegram_id.in_(ack.telegram_ids),
+            UserProgress.last_accessed_date == date.today()
+        )
+    }
+    updated = 0
+    for telegram_id in ack.telegram_ids:
+        if telegram_id in started_today:
+            continue
+        for _ in range(SESSION_WRITE_ATTEMPTS):
+            session, version = load_session(telegram_id)
+            if session.get("opener_sent_on") == today:
+                break
+            session = new_session()
+            session["state"] = "AWAITING_START_CONFIRMATION"
+            session["opener_sent_on"] = today
+            if save_session(telegram_id, session, version):
+                updated += 1
+                break
+    return {"updated": updated}
+
+@router.post("/answer-cache/{lesson_day}")
+async def set_answer_cache_enabled(lesson_day: int, enabled: bool):
+    """
+    Interruptor de la caché de respuestas para un día (por ejemplo, si su material cambió o una
+    respuesta cacheada resultó incorrecta). Desactivarla también vacía la caché de ese día.
+    """
+    await answer_cache.set_enabled(lesson_day, enabled)
+    return {"lesson_day": lesson_day, "enabled": await answer_cache.is_enabled(lesson_day)}
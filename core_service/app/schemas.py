@@ -14,4 +14,16 @@ class ChatHistoryEntry(BaseModel):
 class ConversationResponse(BaseModel):
     conversation_id: str
     answer: str
-    chat_history: List[ChatHistoryEntry] = []
\ No newline at end of file
+    chat_history: List[ChatHistoryEntry] = []
+
+class RosterEntry(BaseModel):
+    telegram_id: int
+    user_name: Optional[str] = None
+    lesson_day: int
+    text: str
+
+class BroadcastAck(BaseModel):
+    telegram_ids: List[int]
+
+class QueryBatchInput(BaseModel):
+    queries: List[QueryInput]
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+from app.core import logic, metrics
+from app.core.retrieval import HybridRetriever, load_lexical_index
+
+def synthesize_queries(lexical_index, samples: int, rng: random.Random) -> list:
+    """
+    Consultas de palabras clave sacadas de los propios chunks: los 2-3 términos más raros de un
+    chunk elegido al azar. El chunk de origen es el relevante.
+    """
+    terms_by_doc = {}
+    for term, docs in lexical_index.postings.items():
+        for doc_id, _ in docs:
+            terms_by_doc.setdefault(doc_id, []).append(term)
+    candidates = [doc_id for doc_id, terms in terms_by_doc.items() if len(terms) >= 3]
+    queries = []
+    for doc_id in rng.sample(candidates, min(samples, len(candidates))):
+        terms = sorted(terms_by_doc[doc_id], key=lambda term: lexical_index.idf[term], reverse=True)
+        query = " ".join(terms[:rng.choice((2, 3))])
+        queries.append({"query": query, "relevant": [lexical_index.chunks[doc_id]]})
+    return queries
+
+def load_labeled_queries(path: str) -> dict:
+    """
+    Archivo JSON con [{"day": 1, "query": "...", "relevant": ["fragmento del chunk esperado", ...]}].
+    """
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    by_day = {}
+    for item in items:
+        by_day.setdefault(int(item["day"]), []).append({"query": item["query"], "relevant": item["relevant"]})
+    return by_day
+
+def is_hit(documents: list, relevant: list) -> bool:
+    return any(fragment in document.page_content for document in documents for fragment in relevant)
+
+def _timed(search) -> tuple:
+    started = time.perf_counter()
+    documents = search()
+    return documents, time.perf_counter() - started
+
+def evaluate_day(day: int, queries: list, k: int, fetch_k: int) -> list:
+    """
+    Ejecuta cada consulta con MMR sobre FAISS (el recuperador anterior) y con el HybridRetriever,
+    y devuelve latencia, acierto y si el híbrido la respondió solo con el índice léxico.
+    """
+    vectorstore = logic.load_daily_vectorstore(day)
+    lexical_index = load_lexical_index(os.path.join(logic.VECTORSTORE_BASE_PATH, f"dia_{day}"), day)
+    if vectorstore is None or lexical_index is None:
+        print(f"Día {day}: falta el vectorstore o el índice léxico; se omite.")
+        return []
+    hybrid = HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index, k=k, fetch_k=fetch_k)
+
+    rows = []
+    for item in queries:
+        mmr_documents, mmr_seconds = _timed(
+            lambda: vectorstore.max_marginal_relevance_search(item["query"], k=k, fetch_k=fetch_k))
+        lexical_before = metrics.snapshot()["counters"].get("retrieval_lexical_only", 0)
+        hybrid_documents, hybrid_seconds = _timed(lambda: hybrid.invoke(item["query"]))
+        rows.append({
+            "lexical_only": metrics.snapshot()["counters"].get("retrieval_lexical_only", 0) > lexical_before,
+            "mmr_seconds": mmr_seconds,
+            "hybrid_seconds": hybrid_seconds,
+            "mmr_hit": is_hit(mmr_documents, item["relevant"]),
+            "hybrid_hit": is_hit(hybrid_documents, item["relevant"]),
+        })
+    return rows
+
+def _summary(rows: list, label: str, k: int) -> str:
+    if not rows:
+        return f"{label}: sin consultas"
+    parts = [f"{label} ({len(rows)} consultas)"]
+    for path in ("mmr", "hybrid"):
+        latencies = sorted(row[f"{path}_seconds"] for row in rows)
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        recall = sum(row[f"{path}_hit"] for row in rows) / len(rows)
+        parts.append(f"  {path:6} recall@{k} {recall:.2f}  latencia mediana {statistics.median(latencies) * 1000:.0f} ms"
+                     f"  p95 {p95 * 1000:.0f} ms")
+    return "\n".join(parts)
+
+def main():
+    """
+    Compara offline el recuperador híbrido (BM25 + FAISS, con atajo solo léxico) contra MMR sobre FAISS
+    en latencia y recall@k. Sin --queries, genera consultas de palabras clave a partir de los chunks.
+    Ejemplo, desde core_service:
+        python scripts/evaluate_retrieval.py --vectorstores ../vectorstores --samples 50
+    Necesita GOOGLE_API_KEY (MMR y el camino híbrido llaman a la API de embeddings).
+    """
+    parser = argparse.ArgumentParser(description="Evalúa el recuperador híbrido contra MMR.")
+    parser.add_argument("--vectorstores", default=logic.VECTORSTORE_BASE_PATH, help="Directorio con los dia_N.")
+    parser.add_argument("--day", type=int, action="append", help="Día a evaluar (se puede repetir). Por defecto, todos.")
+    parser.add_argument("--queries", help="Consultas etiquetadas en JSON; si no se indica, se generan.")
+    parser.add_argument("--samples", type=int, default=30, help="Consultas generadas por día.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logic.VECTORSTORE_BASE_PATH = args.vectorstores
+    labeled = load_labeled_queries(args.queries) if args.queries else None
+    days = args.day or sorted(
+        int(name.split("_")[1]) for name in os.listdir(args.vectorstores) if name.startswith("dia_")
+    )
+    rng = random.Random(args.seed)
+
+    all_rows = []
+    for day in days:
+        if labeled is not None:
+            queries = labeled.get(day, [])
+        else:
+            lexical_index = load_lexical_index(os.path.join(args.vectorstores, f"dia_{day}"), day)
+            queries = synthesize_queries(lexical_index, args.samples, rng) if lexical_index else []
+        rows = evaluate_day(day, queries, args.k, args.fetch_k)
+        if rows:
+            print(_summary(rows, f"Día {day}", args.k))
+        all_rows.extend(rows)
+
+    lexical_rows = [row for row in all_rows if row["lexical_only"]]
+    print(_summary(all_rows, "Total", args.k))
+    # Donde el híbrido se salta FAISS es donde podría perder recall frente a MMR.
+    print(_summary(lexical_rows, "Solo léxico", args.k))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+import urllib.error
+import urllib.request
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+def measure_import(service_dir: str, runs: int) -> float:
+    """
+    Mediana del tiempo de `import app.main` en procesos nuevos.
+    """
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET], cwd=service_dir, capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+def _request(url: str, payload: dict = None, timeout: float = 120) -> tuple:
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def measure_first_answer(service_dir: str, port: int, telegram_id: str, wait_ready: bool) -> dict:
+    """
+    Arranca uvicorn, espera a que responda y mide la primera consulta a /conversation/query.
+    Con `wait_ready` espera antes a /ready (si la versión medida lo tiene).
+    """
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+        cwd=service_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                if _request(base_url + "/", timeout=1)[0] == 200:
+                    break
+            except OSError:
+                pass
+            if server.poll() is not None:
+                raise RuntimeError("uvicorn terminó antes de responder.")
+            time.sleep(0.05)
+        listening = time.perf_counter() - started
+
+        ready = None
+        if wait_ready:
+            while _request(base_url + "/ready", timeout=5)[0] == 503:
+                time.sleep(0.1)
+            ready = time.perf_counter() - started
+
+        query_started = time.perf_counter()
+        status, _ = _request(base_url + "/conversation/query", {"phone_number": telegram_id, "question": "hola"})
+        first_answer = time.perf_counter() - query_started
+        return {"listening": listening, "ready": ready, "first_answer": first_answer, "status": status}
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+def checkout(ref: str) -> str:
+    """
+    Copia de core_service en la versión `ref` (git worktree temporal), para medir el antes.
+    """
+    worktree = tempfile.mkdtemp(prefix="core_service_")
+    shutil.rmtree(worktree)
+    subprocess.run(["git", "worktree", "add", "--detach", worktree, ref], cwd=SERVICE_DIR, check=True, capture_output=True)
+    return worktree
+
+def main():
+    """
+    Mide el tiempo de importación y el del primer mensaje respondido del core_service.
+    Ejemplo (antes y después del warmup):
+        python scripts/measure_cold_start.py --ref <commit-anterior> --ref HEAD
+    Necesita las dependencias del servicio, GOOGLE_API_KEY, DATABASE_URL y los vectorstores
+    (VECTORSTORE_BASE_PATH por defecto es /vectorstores/).
+    """
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío del core_service.")
+    parser.add_argument("--ref", action="append", help="Versión de git a medir (se puede repetir). Por defecto, el árbol actual.")
+    parser.add_argument("--runs", type=int, default=5, help="Repeticiones de la medición de importación.")
+    parser.add_argument("--port", type=int, default=8102)
+    parser.add_argument("--telegram-id", type=int, default=999000111,
+                        help="Usuaria de prueba para la primera consulta (cada versión usa una nueva a partir de esta).")
+    parser.add_argument("--no-wait-ready", action="store_true", help="No esperar a /ready antes de la primera consulta.")
+    args = parser.parse_args()
+
+    for run, ref in enumerate(args.ref or [None]):
+        service_dir = SERVICE_DIR
+        worktree = None
+        if ref:
+            worktree = checkout(ref)
+            service_dir = os.path.join(worktree, os.path.relpath(SERVICE_DIR, _repo_root()))
+        try:
+            import_seconds = measure_import(service_dir, args.runs)
+            # Siempre una usuaria nueva: su primer mensaje recibe la apertura del día en todas las versiones.
+            telegram_id = str(args.telegram_id + run)
+            result = measure_first_answer(service_dir, args.port, telegram_id, not args.no_wait_ready)
+        finally:
+            if worktree:
+                subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=SERVICE_DIR, check=False)
+        ready = f"{result['ready']:.2f}s" if result["ready"] is not None else "-"
+        print(f"{ref or 'árbol actual'}: import {import_seconds:.2f}s, escuchando {result['listening']:.2f}s, "
+              f"listo {ready}, primera respuesta {result['first_answer']:.2f}s (HTTP {result['status']})")
+
+def _repo_root() -> str:
+    return subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=SERVICE_DIR, capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+if __name__ == "__main__":
+    main()
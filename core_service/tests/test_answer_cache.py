@@ -0,0 +1,22 @@
+import asyncio
+from app.core import answer_cache as answer_cache_module
+from app.core.answer_cache import AnswerCache
+from app.core.state_store import MemoryStateStore
+
+
+def test_day_switch_is_shared_through_the_store(monkeypatch):
+    store = MemoryStateStore()
+    monkeypatch.setattr(answer_cache_module, "get_state_store", lambda: store)
+    cache = AnswerCache()
+    cache.put(3, "v1", "", "¿Qué es una variable?", "Un nombre para un valor.", 1.0)
+
+    async def toggle():
+        await cache.set_enabled(3, False)
+        disabled = await cache.is_enabled(3)
+        # Otro worker ve el interruptor a través del almacén de estado.
+        seen_by_other_worker = await AnswerCache().is_enabled(3)
+        await cache.set_enabled(3, True)
+        return disabled, seen_by_other_worker, await cache.is_enabled(3)
+
+    assert asyncio.run(toggle()) == (False, False, True)
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,15 @@
+import asyncio
+from app.core import evaluation
+
+
+def test_unreadable_bank_does_not_record_a_score(monkeypatch):
+    saved = []
+    monkeypatch.setattr(evaluation, "load_evaluation_bank", lambda lesson_day: None)
+    monkeypatch.setattr(evaluation, "save_completion", lambda *args: saved.append(args))
+    eval_state = {"current_q_index": 2, "answers": ["print", "una variable"], "lesson_day": 1, "bank_version": 3}
+
+    answer, new_state = asyncio.run(evaluation.process_evaluation_answer(None, 123, "para explicar", eval_state))
+
+    assert new_state == {"current_q_index": 2, "answers": ["print", "una variable"], "lesson_day": 1, "bank_version": 3}
+    assert "de nuevo" in answer
+    assert saved == []
@@ -0,0 +1,26 @@
+from app.core.prompt_budget import LAST_TURN_MIN_TOKENS, estimate_tokens, fit_history
+
+LONG_ANSWER = "Una variable guarda un valor con un nombre. " * 100
+
+
+def test_latest_turn_is_kept_when_it_does_not_fit():
+    chat_history = [("¿Qué es print?", "Muestra un texto."), ("¿Qué es una variable?", LONG_ANSWER)]
+    history, trimmed = fit_history(chat_history, 60)
+    assert "Human: ¿Qué es una variable?" in history
+    assert "Assistant: Una variable guarda" in history
+    assert estimate_tokens(history) <= 60
+    assert trimmed == 2
+
+
+def test_latest_turn_keeps_a_minimum_with_a_tiny_budget():
+    history, _ = fit_history([("¿Qué es una variable?", LONG_ANSWER)], 0)
+    assert "¿Qué es una variable?" in history
+    assert estimate_tokens(history) <= LAST_TURN_MIN_TOKENS
+
+
+def test_older_turns_are_summarized_after_the_latest():
+    chat_history = [(f"pregunta {i}", "respuesta " * 10) for i in range(5)]
+    history, trimmed = fit_history(chat_history, 80)
+    assert history.endswith("Human: pregunta 4\nAssistant: " + "respuesta " * 10)
+    assert history.startswith("\n(Temas tratados antes: ")
+    assert trimmed == 3
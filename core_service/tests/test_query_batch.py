@@ -0,0 +1,28 @@
+import json
+import asyncio
+from app.routes import conversation
+from app.schemas import QueryBatchInput
+
+
+def test_failed_group_still_answers_every_index(monkeypatch):
+    async def fail_after_first(items, publish):
+        index, query = items[0]
+        await publish({"index": index, "conversation_id": query.phone_number, "answer": "ok"})
+        raise RuntimeError("conexión perdida")
+
+    monkeypatch.setattr(conversation, "prefetch_batch_resources", lambda telegram_ids: None)
+    monkeypatch.setattr(conversation, "process_user_group", fail_after_first)
+    batch = QueryBatchInput(queries=[
+        {"phone_number": "1", "question": "hola"},
+        {"phone_number": "2", "question": "hola"},
+        {"phone_number": "1", "question": "sigo"},
+    ])
+
+    async def collect():
+        response = await conversation.handle_query_batch(batch)
+        return [json.loads(line) async for line in response.body_iterator]
+
+    # Sin la línea de error del índice 2, el stream esperaría para siempre.
+    lines = sorted(asyncio.run(asyncio.wait_for(collect(), timeout=5)), key=lambda line: line["index"])
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert lines[2] == {"index": 2, "conversation_id": "1", "error": "conexión perdida"}
@@ -0,0 +1,41 @@
+from datetime import date
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.core.database import Base
+from app.core.state_store import DatabaseStateStore, MemoryStateStore
+from app.models.user_progress import UserProgress, UserSession
+from app.routes import conversation
+
+SESSION = {"state": "IN_EVALUATION", "chat_history": [], "expected_output": None}
+
+
+def make_db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(UserProgress(user_telegram_id=1, user_name="Ana", start_date=date.today(), last_accessed_date=date.today()))
+    db.add(UserSession(user_telegram_id=1, session_data=SESSION))
+    db.commit()
+    return engine, db
+
+
+def test_non_durable_backend_keeps_legacy_sessions(monkeypatch):
+    _, db = make_db()
+    store = MemoryStateStore()
+    monkeypatch.setattr(conversation, "STATE_BACKEND", "memory")
+    monkeypatch.setattr(conversation, "get_state_store", lambda: store)
+
+    assert conversation.migrate_legacy_sessions(db) == 0
+    assert db.query(UserSession).count() == 1
+    assert store.get(conversation.session_key(1)) == (None, 0)
+
+
+def test_durable_backend_migrates_and_deletes(monkeypatch):
+    engine, db = make_db()
+    store = DatabaseStateStore(engine)
+    monkeypatch.setattr(conversation, "STATE_BACKEND", "database")
+    monkeypatch.setattr(conversation, "get_state_store", lambda: store)
+
+    assert conversation.migrate_legacy_sessions(db) == 1
+    assert db.query(UserSession).count() == 0
+    assert store.get(conversation.session_key(1)) == (SESSION, 1)
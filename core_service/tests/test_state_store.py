@@ -0,0 +1,108 @@
+import time
+import threading
+import multiprocessing
+import pytest
+from app.core.state_store import (
+    MemoryStateStore, SQLiteStateStore, DatabaseStateStore, RedisStateStore, try_acquire_lease, release_lease
+)
+
+WORKERS = 6
+INCREMENTS = 200
+KEY = "session:1"
+
+
+def increment(store, key: str, times: int) -> None:
+    """
+    Suma 1 al contador `times` veces con lectura + compare-and-set, reintentando ante conflicto.
+    """
+    for _ in range(times):
+        while True:
+            value, version = store.get(key)
+            counter = (value or {}).get("counter", 0)
+            if store.compare_and_set(key, {"counter": counter + 1}, version):
+                break
+
+
+def _sqlite_worker(path: str) -> None:
+    increment(SQLiteStateStore(path), KEY, INCREMENTS)
+
+
+def _database_worker(url: str) -> None:
+    from sqlalchemy import create_engine
+
+    increment(DatabaseStateStore(create_engine(url)), KEY, INCREMENTS)
+
+
+def _run_processes(target, arg) -> None:
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=target, args=(arg,)) for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+
+def _run_threads(make_store) -> None:
+    threads = [threading.Thread(target=increment, args=(make_store(), KEY, INCREMENTS)) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_sqlite_store_has_no_lost_updates_across_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteStateStore(path)
+    _run_processes(_sqlite_worker, path)
+    value, version = SQLiteStateStore(path).get(KEY)
+    assert value == {"counter": WORKERS * INCREMENTS}
+    assert version == WORKERS * INCREMENTS
+
+
+def test_database_store_has_no_lost_updates_across_processes(tmp_path):
+    sqlalchemy = pytest.importorskip("sqlalchemy")
+    url = f"sqlite:///{tmp_path / 'state.db'}"
+    DatabaseStateStore(sqlalchemy.create_engine(url))
+    _run_processes(_database_worker, url)
+    value, _ = DatabaseStateStore(sqlalchemy.create_engine(url)).get(KEY)
+    assert value == {"counter": WORKERS * INCREMENTS}
+
+
+def test_memory_store_has_no_lost_updates_across_threads():
+    store = MemoryStateStore()
+    _run_threads(lambda: store)
+    assert store.get(KEY) == ({"counter": WORKERS * INCREMENTS}, WORKERS * INCREMENTS)
+
+
+def test_redis_store_has_no_lost_updates_against_fake_server():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    # Un cliente por hilo, como workers distintos contra el mismo servidor.
+    _run_threads(lambda: RedisStateStore("", client=fakeredis.FakeRedis(server=server, decode_responses=True)))
+    store = RedisStateStore("", client=fakeredis.FakeRedis(server=server, decode_responses=True))
+    assert store.get(KEY) == ({"counter": WORKERS * INCREMENTS}, WORKERS * INCREMENTS)
+
+
+def test_stale_writer_cannot_resurrect_deleted_key():
+    store = MemoryStateStore()
+    assert store.compare_and_set(KEY, {"state": "IN_EVALUATION"}, 0)
+    _, stale_version = store.get(KEY)
+    assert store.compare_and_set(KEY, None, stale_version)
+    assert not store.compare_and_set(KEY, {"state": "IN_EVALUATION"}, stale_version)
+    assert store.get(KEY) == (None, 2)
+
+
+def test_lease_is_exclusive_until_released_or_expired():
+    store = MemoryStateStore()
+    owner = try_acquire_lease(store, "lease:1", ttl=30)
+    assert owner is not None
+    assert try_acquire_lease(store, "lease:1", ttl=30) is None
+
+    release_lease(store, "lease:1", "otro-dueño")
+    assert try_acquire_lease(store, "lease:1", ttl=30) is None
+    release_lease(store, "lease:1", owner)
+    assert try_acquire_lease(store, "lease:1", ttl=0.05) is not None
+
+    time.sleep(0.1)
+    assert try_acquire_lease(store, "lease:1", ttl=30) is not None
@@ -1,12 +1,36 @@
 import os
+import sys
+import json
+import time
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import fitz
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from dotenv import load_dotenv
 
+# El tokenizador léxico vive en el core_service, que es quien consulta el índice.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "core_service"))
+from app.core.lexical_tokenizer import LEXICAL_TOKENIZER, tokenize_for_lexical
+
 load_dotenv()
 
+EMBEDDING_MODEL = "models/embedding-001"
+EVALUATION_BANK_FILENAME = "evaluacion.json"
+LEXICAL_INDEX_FILENAME = "lexical.json"
+
+# Configuración del pipeline: extracción en procesos, embeddings en lotes concurrentes.
+EXTRACT_WORKERS = int(os.getenv("PREPROCESS_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+EMBED_BATCH_SIZE = int(os.getenv("PREPROCESS_EMBED_BATCH_SIZE", "100"))
+EMBED_CONCURRENCY = int(os.getenv("PREPROCESS_EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("PREPROCESS_EMBED_MAX_RETRIES", "5"))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+# Caracteres de texto acumulado a partir de los cuales se divide en chunks durante la extracción.
+SPLIT_BUFFER_CHARS = CHUNK_SIZE * 8
+
 def get_embeddings_local():
     """
     Crea y devuelve una instancia de embeddings de Google Generative AI.
@@ -14,30 +38,151 @@ def get_embeddings_local():
     google_api_key = os.getenv("GOOGLE_API_KEY")
     if not google_api_key:
         raise ValueError("GOOGLE_API_KEY no encontrada en el archivo .env")
-    return GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=google_api_key)
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=google_api_key)
+
+def write_json_atomic(path: str, data) -> None:
+    """
+    Escribe el JSON en un archivo temporal y lo reemplaza de una vez: el core_service recarga
+    estos archivos cuando cambia su mtime y nunca debe leer uno a medio escribir.
+    """
+    temp_path = f"{path}.tmp-{os.getpid()}"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, path)
 
-def extract_text_from_pdf(file_path: str) -> str:
+def build_lexical_index(chunks: list) -> dict:
     """
-    Extrae texto de un archivo PDF de forma robusta usando PyMuPDF (fitz).
+    Construye un índice BM25 (listas invertidas) sobre los mismos chunks que se embeben en FAISS.
+    """
+    postings = {}
+    doc_lengths = []
+    for doc_id, chunk in enumerate(chunks):
+        term_counts = Counter(tokenize_for_lexical(chunk))
+        doc_lengths.append(sum(term_counts.values()))
+        for term, tf in term_counts.items():
+            postings.setdefault(term, []).append([doc_id, tf])
+    return {
+        "version": 1,
+        "tokenizer": LEXICAL_TOKENIZER,
+        "k1": 1.5,
+        "b": 0.75,
+        "chunks": chunks,
+        "doc_lengths": doc_lengths,
+        "postings": postings,
+    }
+
+def iter_pdf_pages(file_path: str):
+    """
+    Recorre el PDF página a página con PyMuPDF (fitz) y devuelve el texto de cada una.
     """
-    text = ""
     try:
         with fitz.open(file_path) as doc:
             for page in doc:
                 try:
-                    text += page.get_text() + "\n"
+                    yield page.get_text()
                 except Exception as page_error:
                     print(f"  - Advertencia: Error extrayendo texto de una página en {file_path}. Error: {page_error}")
                     continue
     except Exception as e:
         print(f"Error crítico abriendo o leyendo el PDF {file_path} con PyMuPDF: {e}")
-    return text
+
+def iter_chunks(pages, text_splitter, buffer_chars: int = SPLIT_BUFFER_CHARS):
+    """
+    Divide el texto en chunks a medida que llegan las páginas, sin juntar el PDF completo en memoria.
+    El último chunk de cada división puede estar cortado, así que se vuelve a dividir junto con
+    las páginas siguientes.
+    """
+    buffer = ""
+    for page_text in pages:
+        buffer += page_text + "\n"
+        if len(buffer) < buffer_chars:
+            continue
+        chunks = text_splitter.split_text(buffer)
+        if len(chunks) > 1:
+            yield from chunks[:-1]
+            buffer = chunks[-1] + "\n"
+    if buffer.strip():
+        yield from text_splitter.split_text(buffer)
+
+def extract_and_chunk(day_number: int, pdf_filepath: str) -> tuple:
+    """
+    Etapa 1 (en un proceso aparte): extrae el texto del PDF página a página y lo divide en chunks.
+    """
+    started = time.perf_counter()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len)
+    chunks = list(iter_chunks(iter_pdf_pages(pdf_filepath), text_splitter))
+    return day_number, chunks, time.perf_counter() - started
+
+def embed_with_retry(embeddings, texts: list) -> list:
+    """
+    Embebe un lote de textos reintentando con backoff exponencial ante errores (cuotas, red).
+    """
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt, 60) + random.uniform(0, 1)
+            print(f"  - Error embebiendo un lote ({e}). Reintento {attempt + 1} en {delay:.1f}s.")
+            time.sleep(delay)
+
+def embed_and_write_day(chunks: list, day_store_path: str, embeddings, embed_pool: ThreadPoolExecutor) -> dict:
+    """
+    Etapas 2 y 3: embebe los chunks del día en lotes concurrentes (compartiendo el límite global
+    de EMBED_CONCURRENCY) y escribe el índice FAISS y el léxico en cuanto el día termina.
+    """
+    started = time.perf_counter()
+    batches = [chunks[i:i + EMBED_BATCH_SIZE] for i in range(0, len(chunks), EMBED_BATCH_SIZE)]
+    batch_futures = [embed_pool.submit(embed_with_retry, embeddings, batch) for batch in batches]
+    vectors = [vector for future in batch_futures for vector in future.result()]
+    embed_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectorstore = FAISS.from_embeddings(text_embeddings=list(zip(chunks, vectors)), embedding=embeddings)
+    os.makedirs(day_store_path, exist_ok=True)
+    vectorstore.save_local(day_store_path)
+    write_json_atomic(os.path.join(day_store_path, LEXICAL_INDEX_FILENAME), build_lexical_index(chunks))
+    return {"embed": embed_seconds, "write": time.perf_counter() - started}
+
+def build_evaluation_bank(source_path: str, day_store_path: str, embeddings, embed_pool: ThreadPoolExecutor) -> bool:
+    """
+    Embebe las respuestas de referencia del banco de preguntas de un día y lo guarda junto a su vectorstore.
+    El core_service compara las respuestas de las estudiantes contra estos vectores antes de llamar al LLM.
+    Los lotes pasan por el mismo embed_pool que los chunks, así respetan EMBED_CONCURRENCY.
+    """
+    with open(source_path, encoding="utf-8") as f:
+        bank = json.load(f)
+
+    reference_texts = [ref for question in bank["questions"] for ref in question.get("references", [])]
+    try:
+        batches = [reference_texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(reference_texts), EMBED_BATCH_SIZE)]
+        batch_futures = [embed_pool.submit(embed_with_retry, embeddings, batch) for batch in batches]
+        vectors = [vector for future in batch_futures for vector in future.result()]
+    except Exception as e:
+        # Sin embeddings el banco se guarda igual y el core_service califica solo con el LLM.
+        print(f"Error embebiendo las referencias de {source_path}: {e}. Se guarda el banco sin embeddings.")
+        vectors = None
+
+    vector_iter = iter(vectors or [])
+    for question in bank["questions"]:
+        question["references"] = [
+            {"text": ref, "embedding": next(vector_iter)} if vectors is not None else {"text": ref}
+            for ref in question.get("references", [])
+        ]
+    if vectors is not None:
+        bank["embedding_model"] = EMBEDDING_MODEL
+
+    os.makedirs(day_store_path, exist_ok=True)
+    write_json_atomic(os.path.join(day_store_path, EVALUATION_BANK_FILENAME), bank)
+    return True
 
 def main():
     """
     Script principal para procesar los PDFs y crear los vectorstores diarios.
     """
     pdf_source_directory = "course_content/"
+    evaluation_source_directory = os.path.join(pdf_source_directory, "evaluaciones")
     vectorstore_base_path = "vectorstores/"
 
     if not os.path.exists(pdf_source_directory):
@@ -52,34 +197,72 @@ def main():
         print(f"Error crítico: {e}")
         return
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150, length_function=len)
-
     print("Iniciando preprocesamiento de documentos...")
-    for day_number in range(1, 31):
-        pdf_filename = f"dia_{day_number}.pdf"
-        pdf_filepath = os.path.join(pdf_source_directory, pdf_filename)
+    pipeline_started = time.perf_counter()
 
-        if not os.path.exists(pdf_filepath):
-            continue
+    pdf_days = []
+    evaluation_days = []
+    for day_number in range(1, 31):
+        pdf_filepath = os.path.join(pdf_source_directory, f"dia_{day_number}.pdf")
+        evaluation_filepath = os.path.join(evaluation_source_directory, f"dia_{day_number}.json")
 
-        print(f"Procesando documento para el Día {day_number}: {pdf_filepath}...")
-        raw_text = extract_text_from_pdf(pdf_filepath)
-        
-        if not raw_text.strip():
-            print(f"Advertencia: No se extrajo texto del PDF para el día {day_number}. El archivo puede estar vacío o corrupto.")
-            continue
+        if os.path.exists(evaluation_filepath):
+            evaluation_days.append((day_number, evaluation_filepath))
+        if os.path.exists(pdf_filepath):
+            pdf_days.append((day_number, pdf_filepath))
 
-        chunks = text_splitter.split_text(raw_text)
-        print(f"Día {day_number}: {len(chunks)} chunks generados.")
+    timings = {}
+    with ProcessPoolExecutor(max_workers=EXTRACT_WORKERS) as extract_pool, \
+            ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as embed_pool, \
+            ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as day_pool:
+        extract_futures = [extract_pool.submit(extract_and_chunk, day_number, path) for day_number, path in pdf_days]
+        # Los bancos de evaluación se embeben en paralelo con la extracción de los PDFs.
+        bank_futures = {
+            day_pool.submit(build_evaluation_bank, path, os.path.join(vectorstore_base_path, f"dia_{day_number}"),
+                            embeddings, embed_pool): day_number
+            for day_number, path in evaluation_days
+        }
+        day_futures = {}
 
-        try:
-            vectorstore = FAISS.from_texts(texts=chunks, embedding=embeddings)
+        # Cada día pasa a la etapa de embeddings en cuanto termina su extracción.
+        for future in as_completed(extract_futures):
+            try:
+                day_number, chunks, extract_seconds = future.result()
+            except Exception as e:
+                print(f"Error extrayendo un PDF: {e}")
+                continue
+            if not chunks:
+                print(f"Advertencia: No se extrajo texto del PDF para el día {day_number}. El archivo puede estar vacío o corrupto.")
+                continue
+            print(f"Día {day_number}: {len(chunks)} chunks generados en {extract_seconds:.2f}s.")
+            timings[day_number] = {"extract": extract_seconds, "chunks": len(chunks)}
             day_store_path = os.path.join(vectorstore_base_path, f"dia_{day_number}")
-            os.makedirs(day_store_path, exist_ok=True)
-            vectorstore.save_local(day_store_path)
-            print(f"Vectorstore para el Día {day_number} guardado en: {day_store_path}")
-        except Exception as e:
-            print(f"Error creando/guardando vectorstore para el Día {day_number}: {e}")
+            day_future = day_pool.submit(embed_and_write_day, chunks, day_store_path, embeddings, embed_pool)
+            day_futures[day_future] = (day_number, day_store_path)
+
+        for future in as_completed(day_futures):
+            day_number, day_store_path = day_futures[future]
+            try:
+                timings[day_number].update(future.result())
+                print(f"Vectorstore para el Día {day_number} guardado en: {day_store_path}")
+            except Exception as e:
+                timings.pop(day_number, None)
+                print(f"Error creando/guardando vectorstore para el Día {day_number}: {e}")
+
+        for future in as_completed(bank_futures):
+            day_number = bank_futures[future]
+            try:
+                future.result()
+                print(f"Banco de evaluación para el Día {day_number} generado.")
+            except Exception as e:
+                print(f"Error generando el banco de evaluación para el Día {day_number}: {e}")
+
+    print("\nTiempos por día (segundos):")
+    print(f"{'Día':>4} {'chunks':>7} {'extracción':>11} {'embeddings':>11} {'escritura':>10}")
+    for day_number in sorted(timings):
+        t = timings[day_number]
+        print(f"{day_number:>4} {t['chunks']:>7} {t['extract']:>11.2f} {t['embed']:>11.2f} {t['write']:>10.2f}")
+    print(f"Tiempo total: {time.perf_counter() - pipeline_started:.2f}s")
 
     print("\nPreprocesamiento de todos los documentos completado.")
 
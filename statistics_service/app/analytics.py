@@ -0,0 +1,196 @@
+import os
+import time
+import threading
+from datetime import date
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models import UserProgress, LessonCompletion
+from app.export import EXPORT_TABLES, iter_record_batches
+
+# Las completions solo se insertan, pero last_accessed_date se actualiza en su sitio y no siempre
+# cambia la huella de datos: el TTL acota cuánto puede quedar desactualizada la caché.
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "300"))
+COHORT_PERIODS = {"day", "week", "month"}
+
+_lock = threading.Lock()
+_frames: Dict[str, object] = {"version": None, "loaded_at": 0.0, "users": None, "completions": None}
+_results: Dict[tuple, object] = {}
+
+def get_data_version(db: Session) -> tuple:
+    """
+    Huella barata de los datos: conteos y máximos de ambas tablas.
+    """
+    users = db.query(func.count(UserProgress.user_telegram_id), func.max(UserProgress.last_accessed_date)).one()
+    completions = db.query(func.count(LessonCompletion.id), func.max(LessonCompletion.id)).one()
+    return tuple(users) + tuple(completions)
+
+def _read_frame(db: Session, table_name: str) -> pd.DataFrame:
+    _, schema = EXPORT_TABLES[table_name]
+    table = pa.Table.from_batches(list(iter_record_batches(db, table_name)), schema=schema)
+    return table.to_pandas(date_as_object=False)
+
+def load_frames(db: Session) -> Tuple[tuple, pd.DataFrame, pd.DataFrame]:
+    """
+    Devuelve la versión de los datos y los extractos columnares de user_progress y
+    lesson_completions, releyéndolos solo si cambió la versión o venció el TTL.
+    """
+    version = get_data_version(db)
+    with _lock:
+        fresh = time.monotonic() - _frames["loaded_at"] < ANALYTICS_CACHE_TTL
+        if _frames["version"] == version and fresh:
+            return version, _frames["users"], _frames["completions"]
+
+    users = _read_frame(db, "user_progress")
+    completions = _read_frame(db, "lesson_completions")
+    with _lock:
+        _frames.update(version=version, loaded_at=time.monotonic(), users=users, completions=completions)
+        _results.clear()
+    return version, users, completions
+
+def cached_analysis(db: Session, name: str, compute: Callable, *params):
+    """
+    Calcula `compute(users, completions, *params)` una sola vez por versión de los datos.
+    """
+    version, users, completions = load_frames(db)
+    key = (version, name, params)
+    with _lock:
+        if key in _results:
+            return _results[key]
+    result = compute(users, completions, *params)
+    with _lock:
+        _results[key] = result
+    return result
+
+def _cohort_start(start_dates: pd.Series, period: str) -> pd.Series:
+    if period == "day":
+        return start_dates.dt.normalize()
+    # Las semanas empiezan en lunes.
+    return start_dates.dt.to_period("W-SUN" if period == "week" else "M").dt.start_time
+
+def _none_if_nan(values) -> list:
+    return [None if pd.isna(value) else float(value) for value in values]
+
+def compute_cohorts(users: pd.DataFrame, completions: pd.DataFrame, period: str) -> List[dict]:
+    """
+    Tamaño de cada cohorte (por fecha de inicio), lecciones completadas y puntuación promedio por estudiante.
+    """
+    if users.empty:
+        return []
+    per_user = completions.groupby("user_telegram_id").agg(
+        completed_lessons=("lesson_day", "nunique"), average_score=("evaluation_score", "mean")
+    )
+    frame = users.join(per_user, on="user_telegram_id")
+    frame["completed_lessons"] = frame["completed_lessons"].fillna(0)
+    frame["cohort"] = _cohort_start(frame["start_date"], period)
+    grouped = frame.groupby("cohort").agg(
+        students=("user_telegram_id", "size"),
+        average_completed_lessons=("completed_lessons", "mean"),
+        average_score=("average_score", "mean"),
+    )
+    return [
+        {
+            "cohort": cohort.date(),
+            "students": int(row.students),
+            "average_completed_lessons": float(row.average_completed_lessons),
+            "average_score": None if pd.isna(row.average_score) else float(row.average_score),
+        }
+        for cohort, row in grouped.iterrows()
+    ]
+
+def compute_retention(users: pd.DataFrame, completions: pd.DataFrame, period: str, max_days: int) -> List[dict]:
+    """
+    Curva de retención por cohorte: fracción de estudiantes con actividad `n` días o más después
+    de su inicio (según last_accessed_date), para n = 0..max_days. Solo cuentan en el día `n`
+    las estudiantes para las que ese día ya pasó, así las cohortes recientes no aparecen con
+    retención artificialmente baja; si no hay ninguna, el valor es null.
+    """
+    if users.empty:
+        return []
+    start = users["start_date"].to_numpy("datetime64[D]")
+    last_accessed = users["last_accessed_date"].to_numpy("datetime64[D]")
+    today = np.datetime64(date.today(), "D")
+    offsets = np.arange(max_days + 1)
+
+    active_days = (last_accessed - start).astype(np.int64)
+    elapsed_days = (today - start).astype(np.int64)
+    observable = elapsed_days[:, None] >= offsets[None, :]
+    retained = (active_days[:, None] >= offsets[None, :]) & observable
+
+    cohorts = _cohort_start(users["start_date"], period)
+    retained_by_cohort = pd.DataFrame(retained).groupby(cohorts.to_numpy()).sum()
+    observable_by_cohort = pd.DataFrame(observable).groupby(cohorts.to_numpy()).sum()
+    sizes = cohorts.value_counts()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = retained_by_cohort.to_numpy() / observable_by_cohort.to_numpy()
+
+    return [
+        {
+            "cohort": pd.Timestamp(cohort).date(),
+            "students": int(sizes[cohort]),
+            "retention": _none_if_nan(rates[i]),
+        }
+        for i, cohort in enumerate(retained_by_cohort.index)
+    ]
+
+def compute_funnel(users: pd.DataFrame, completions: pd.DataFrame) -> List[dict]:
+    """
+    Embudo por lección: estudiantes que completaron cada día, conversión desde la lección
+    anterior (la primera se compara con el total de inscritas) y abandono día a día.
+    """
+    if completions.empty:
+        return []
+    completed = completions.drop_duplicates(["user_telegram_id", "lesson_day"])
+    counts = completed["lesson_day"].value_counts()
+    lesson_days = np.arange(1, int(counts.index.max()) + 1)
+    students = counts.reindex(lesson_days, fill_value=0).to_numpy()
+
+    enrolled = len(users)
+    previous = np.concatenate(([enrolled], students[:-1]))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        conversion = np.where(previous > 0, students / previous, np.nan)
+        share = students / enrolled if enrolled else np.full(len(students), np.nan)
+
+    return [
+        {
+            "lesson_day": int(day),
+            "students": int(students[i]),
+            "conversion_from_previous": None if np.isnan(conversion[i]) else float(conversion[i]),
+            "drop_off": None if np.isnan(conversion[i]) else float(1 - conversion[i]),
+            "share_of_enrolled": None if np.isnan(share[i]) else float(share[i]),
+        }
+        for i, day in enumerate(lesson_days)
+    ]
+
+def compute_score_distribution(users: pd.DataFrame, completions: pd.DataFrame, bins: int) -> List[dict]:
+    """
+    Histograma de puntuaciones (0-100) por lección con `bins` intervalos iguales, más media,
+    mediana y cuartiles.
+    """
+    scored = completions.dropna(subset=["evaluation_score"])
+    if scored.empty:
+        return []
+    lesson_days, lesson_index = np.unique(scored["lesson_day"].to_numpy(), return_inverse=True)
+    scores = np.clip(scored["evaluation_score"].to_numpy(), 0, 100)
+    bin_index = np.minimum((scores / 100 * bins).astype(np.int64), bins - 1)
+    histogram = np.zeros((len(lesson_days), bins), dtype=np.int64)
+    np.add.at(histogram, (lesson_index, bin_index), 1)
+
+    summary = scored.groupby("lesson_day")["evaluation_score"].describe()
+    bin_edges = np.linspace(0, 100, bins + 1).tolist()
+    return [
+        {
+            "lesson_day": int(day),
+            "count": int(summary.loc[day, "count"]),
+            "mean": float(summary.loc[day, "mean"]),
+            "p25": float(summary.loc[day, "25%"]),
+            "median": float(summary.loc[day, "50%"]),
+            "p75": float(summary.loc[day, "75%"]),
+            "bin_edges": bin_edges,
+            "histogram": histogram[i].tolist(),
+        }
+        for i, day in enumerate(lesson_days)
+    ]
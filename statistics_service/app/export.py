@@ -0,0 +1,151 @@
+import os
+import time
+import argparse
+from typing import Iterator
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models import UserProgress, LessonCompletion
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+
+# Columnas exportadas de cada tabla; la primera es la clave primaria y define el orden.
+EXPORT_TABLES = {
+    "user_progress": (UserProgress, pa.schema([
+        ("user_telegram_id", pa.int64()),
+        ("user_name", pa.string()),
+        ("start_date", pa.date32()),
+        ("last_accessed_date", pa.date32()),
+    ])),
+    "lesson_completions": (LessonCompletion, pa.schema([
+        ("id", pa.int64()),
+        ("user_telegram_id", pa.int64()),
+        ("lesson_day", pa.int64()),
+        ("completed_at", pa.timestamp("us")),
+        ("evaluation_score", pa.float64()),
+    ])),
+}
+
+EXPORT_FORMATS = {
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.stream"),
+}
+
+def iter_record_batches(db: Session, table_name: str, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+    """
+    Lee una tabla en lotes de `batch_size` filas con un cursor en streaming y los devuelve como
+    RecordBatch de Arrow, sin cargar la tabla completa en memoria.
+    """
+    model, schema = EXPORT_TABLES[table_name]
+    columns = [getattr(model, field.name) for field in schema]
+    query = select(*columns).order_by(columns[0]).execution_options(stream_results=True)
+    result = db.execute(query)
+    for rows in result.partitions(batch_size):
+        values = list(zip(*rows))
+        arrays = [pa.array(values[i], type=field.type) for i, field in enumerate(schema)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ChunkSink:
+    """
+    Destino de escritura en memoria que se vacía después de cada lote, para enviar
+    el archivo por partes mientras se genera.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_export(table_name: str, export_format: str, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Genera el export de una tabla en Parquet (un row group por lote) o en el formato de stream
+    de Arrow IPC, devolviendo los bytes de cada lote en cuanto se escriben.
+    Abre su propia sesión porque se consume después de que termina el endpoint.
+    """
+    _, schema = EXPORT_TABLES[table_name]
+    sink = _ChunkSink()
+    db = SessionLocal()
+    try:
+        output = pa.PythonFile(sink, mode="w")
+        if export_format == "parquet":
+            writer = pq.ParquetWriter(output, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_stream(output, schema)
+        for batch in iter_record_batches(db, table_name, batch_size):
+            writer.write_batch(batch)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+        writer.close()
+        yield sink.drain()
+    finally:
+        db.close()
+
+def export_to_file(table_name: str, export_format: str, output_path: str, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    Escribe el export de una tabla en disco y devuelve el número de filas.
+    En Arrow se usa el formato de archivo IPC (legible con pyarrow.feather o pandas.read_feather).
+    """
+    _, schema = EXPORT_TABLES[table_name]
+    rows = 0
+    db = SessionLocal()
+    try:
+        if export_format == "parquet":
+            writer = pq.ParquetWriter(output_path, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_file(output_path, schema)
+        try:
+            for batch in iter_record_batches(db, table_name, batch_size):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        finally:
+            writer.close()
+    finally:
+        db.close()
+    return rows
+
+def main():
+    """
+    CLI: python -m app.export --format parquet --output ./exports
+    """
+    parser = argparse.ArgumentParser(description="Exporta user_progress y lesson_completions en formato columnar.")
+    parser.add_argument("--table", choices=sorted(EXPORT_TABLES), action="append",
+                        help="Tabla a exportar (se puede repetir). Por defecto, todas.")
+    parser.add_argument("--format", dest="export_format", choices=sorted(EXPORT_FORMATS), default="parquet")
+    parser.add_argument("--output", default="exports", help="Directorio de salida.")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    extension = EXPORT_FORMATS[args.export_format][0]
+    for table_name in args.table or sorted(EXPORT_TABLES):
+        output_path = os.path.join(args.output, f"{table_name}.{extension}")
+        started = time.perf_counter()
+        rows = export_to_file(table_name, args.export_format, output_path, args.batch_size)
+        print(f"{table_name}: {rows} filas exportadas a {output_path} en {time.perf_counter() - started:.2f}s.")
+
+if __name__ == "__main__":
+    main()
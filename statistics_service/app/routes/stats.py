@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func, distinct
 from typing import List
 from datetime import date, timedelta
 from app.database import get_db
 from app.models import UserProgress, LessonCompletion
-from app.schemas import StudentStat, DailyActivityStat, LessonPerformanceStat, ActiveUsersStat
+from app.schemas import (
+    StudentStat, DailyActivityStat, LessonPerformanceStat, ActiveUsersStat,
+    CohortStat, RetentionCurve, FunnelStep, ScoreDistribution
+)
+from app.export import EXPORT_TABLES, EXPORT_FORMATS, EXPORT_BATCH_SIZE, stream_export
+from app import analytics
 
 router = APIRouter()
 
@@ -57,4 +63,61 @@ def get_active_users_last_7_days(db: Session = Depends(get_db)):
         UserProgress.last_accessed_date >= seven_days_ago
     ).scalar()
 
-    return {"active_users_count": count or 0}
\ No newline at end of file
+    return {"active_users_count": count or 0}
+
+@router.get("/export/{table_name}")
+def export_table(
+    table_name: str,
+    export_format: str = Query("parquet", alias="format"),
+    batch_size: int = Query(EXPORT_BATCH_SIZE, gt=0, le=100000)
+):
+    """
+    Exporta `user_progress` o `lesson_completions` en Parquet o Arrow (stream IPC),
+    leyendo y enviando la tabla por lotes.
+    """
+    if table_name not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Tabla desconocida. Opciones: {sorted(EXPORT_TABLES)}")
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato desconocido. Opciones: {sorted(EXPORT_FORMATS)}")
+
+    extension, media_type = EXPORT_FORMATS[export_format]
+    return StreamingResponse(
+        stream_export(table_name, export_format, batch_size),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table_name}.{extension}"'}
+    )
+
+def _check_period(period: str) -> None:
+    if period not in analytics.COHORT_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Periodo desconocido. Opciones: {sorted(analytics.COHORT_PERIODS)}")
+
+@router.get("/cohorts", response_model=List[CohortStat])
+def get_cohorts(period: str = "week", db: Session = Depends(get_db)):
+    """
+    Agrupa a las estudiantes en cohortes por fecha de inicio (día, semana o mes) con su
+    promedio de lecciones completadas y de puntuación.
+    """
+    _check_period(period)
+    return analytics.cached_analysis(db, "cohorts", analytics.compute_cohorts, period)
+
+@router.get("/retention", response_model=List[RetentionCurve])
+def get_retention(period: str = "week", max_days: int = Query(30, ge=0, le=365), db: Session = Depends(get_db)):
+    """
+    Curvas de retención por cohorte, ideales para un mapa de calor cohorte x día.
+    """
+    _check_period(period)
+    return analytics.cached_analysis(db, "retention", analytics.compute_retention, period, max_days)
+
+@router.get("/funnel", response_model=List[FunnelStep])
+def get_funnel(db: Session = Depends(get_db)):
+    """
+    Embudo de lecciones: cuántas estudiantes completan cada día y el abandono día a día.
+    """
+    return analytics.cached_analysis(db, "funnel", analytics.compute_funnel)
+
+@router.get("/score-distribution", response_model=List[ScoreDistribution])
+def get_score_distribution(bins: int = Query(10, ge=1, le=100), db: Session = Depends(get_db)):
+    """
+    Distribución de puntuaciones por lección (histograma, media y cuartiles).
+    """
+    return analytics.cached_analysis(db, "score_distribution", analytics.compute_score_distribution, bins)
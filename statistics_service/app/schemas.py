@@ -43,4 +43,57 @@ class ActiveUsersStat(BaseModel):
     """
     Schema para el conteo de usuarias activas en un periodo.
     """
-    active_users_count: int
\ No newline at end of file
+    active_users_count: int
+
+class CohortStat(BaseModel):
+    """
+    Schema para el resumen de una cohorte de estudiantes por fecha de inicio.
+    """
+    cohort: date
+    students: int
+    average_completed_lessons: float
+    average_score: Optional[float] = None
+
+    class Config:
+        orm_mode = True
+
+class RetentionCurve(BaseModel):
+    """
+    Schema para la curva de retención de una cohorte; `retention[n]` es la fracción
+    de estudiantes activas `n` días después de su inicio.
+    """
+    cohort: date
+    students: int
+    retention: List[Optional[float]]
+
+    class Config:
+        orm_mode = True
+
+class FunnelStep(BaseModel):
+    """
+    Schema para un paso del embudo de lecciones.
+    """
+    lesson_day: int
+    students: int
+    conversion_from_previous: Optional[float] = None
+    drop_off: Optional[float] = None
+    share_of_enrolled: Optional[float] = None
+
+    class Config:
+        orm_mode = True
+
+class ScoreDistribution(BaseModel):
+    """
+    Schema para la distribución de puntuaciones de una lección.
+    """
+    lesson_day: int
+    count: int
+    mean: float
+    p25: float
+    median: float
+    p75: float
+    bin_edges: List[float]
+    histogram: List[int]
+
+    class Config:
+        orm_mode = True